@@ -0,0 +1,195 @@
+"""Read-only HTTP API serving the dashboard datasets from the shared cache.
+
+    python api.py --port 8502
+
+GET /datasets lists the datasets. GET /datasets/<name> returns one as JSON
+records, or as an Arrow IPC file with ?format=arrow or an Accept header of
+application/vnd.apache.arrow.file. Responses carry an ETag and honour
+If-None-Match, and are gzipped when the client accepts it.
+
+Datasets come from the same loaders as the app, so requests are served by
+the published artifacts and the disk cache rather than the database.
+Serialized responses are kept for API_CACHE_SECONDS.
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import time
+from collections import namedtuple
+from urllib.parse import parse_qs, urlsplit
+
+import pyarrow as pa
+
+import datasets
+from config import get_setting
+
+logger = logging.getLogger("api")
+
+ARROW_TYPE = "application/vnd.apache.arrow.file"
+
+DATASETS = {load.__name__[len("get_"):]: load for load in datasets.DASHBOARD_DATASETS + [
+    datasets.get_client_performance,
+    datasets.get_depositor_performance,
+]}
+
+STATUS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+          405: "Method Not Allowed", 500: "Internal Server Error"}
+
+Response = namedtuple("Response", ["expires_at", "etag", "content_type", "body", "gzipped_body"])
+
+# (name, format) -> Response, and the locks that let one request per key
+# build it while the others wait for the result.
+_responses = {}
+_building = {}
+
+
+def serialize(df, fmt):
+
+    # Tables that set a labelled index (e.g. the performance tables) keep
+    # it as a column.
+    if df.index.name is not None:
+        df = df.reset_index()
+
+    if fmt == "arrow":
+        sink = pa.BufferOutputStream()
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        return ARROW_TYPE, sink.getvalue().to_pybytes()
+
+    body = df.to_json(orient="records", date_format="iso")
+    return "application/json", body.encode()
+
+
+def build_response(name, fmt):
+
+    content_type, body = serialize(DATASETS[name](), fmt)
+    etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+    return Response(time.monotonic() + get_setting("API_CACHE_SECONDS", 60),
+                    etag, content_type, body, gzip.compress(body, compresslevel=5))
+
+
+async def get_response(name, fmt):
+
+    key = (name, fmt)
+    response = _responses.get(key)
+    if response is not None and response.expires_at > time.monotonic():
+        return response
+
+    lock = _building.setdefault(key, asyncio.Lock())
+    async with lock:
+        response = _responses.get(key)
+        if response is None or response.expires_at <= time.monotonic():
+            # Loaders block on disk and the database.
+            response = await asyncio.get_running_loop().run_in_executor(None, build_response, name, fmt)
+            _responses[key] = response
+    return response
+
+
+def reply(writer, status, headers=(), body=b""):
+
+    lines = ["HTTP/1.1 {} {}".format(status, STATUS[status]),
+             "Content-Length: {}".format(len(body)), "Connection: close"]
+    lines += ["{}: {}".format(*header) for header in headers]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+
+def reply_json(writer, status, payload):
+
+    reply(writer, status, [("Content-Type", "application/json")], json.dumps(payload).encode())
+
+
+async def handle(reader, writer):
+
+    try:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            field, _, value = line.partition(":")
+            headers[field.strip().lower()] = value.strip()
+
+        if len(request_line) != 3:
+            reply_json(writer, 400, {"error": "malformed request"})
+        elif request_line[0] != "GET":
+            reply_json(writer, 405, {"error": "only GET is supported"})
+        else:
+            await route(writer, request_line[1], headers)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def route(writer, target, headers):
+
+    url = urlsplit(target)
+    path = url.path.rstrip("/")
+
+    if path == "/healthz":
+        reply_json(writer, 200, {"status": "ok"})
+        return
+    if path == "/datasets":
+        reply_json(writer, 200, {"datasets": [
+            {"name": name, "json": "/datasets/{}".format(name), "arrow": "/datasets/{}?format=arrow".format(name)}
+            for name in DATASETS]})
+        return
+
+    name = path[len("/datasets/"):] if path.startswith("/datasets/") else None
+    if name not in DATASETS:
+        reply_json(writer, 404, {"error": "unknown dataset"})
+        return
+
+    fmt = parse_qs(url.query).get("format", [None])[0]
+    if fmt is None:
+        fmt = "arrow" if ARROW_TYPE in headers.get("accept", "") else "json"
+    if fmt not in ("json", "arrow"):
+        reply_json(writer, 400, {"error": "format must be json or arrow"})
+        return
+
+    try:
+        response = await get_response(name, fmt)
+    except Exception:
+        logger.exception("could not load %s", name)
+        reply_json(writer, 500, {"error": "could not load {}".format(name)})
+        return
+
+    cache_headers = [("ETag", response.etag), ("Vary", "Accept, Accept-Encoding"),
+                     ("Cache-Control", "max-age={}".format(get_setting("API_CACHE_SECONDS", 60)))]
+    if response.etag in [tag.strip() for tag in headers.get("if-none-match", "").split(",")]:
+        reply(writer, 304, cache_headers)
+        return
+
+    if "gzip" in headers.get("accept-encoding", ""):
+        reply(writer, 200, cache_headers + [("Content-Type", response.content_type),
+                                            ("Content-Encoding", "gzip")], response.gzipped_body)
+    else:
+        reply(writer, 200, cache_headers + [("Content-Type", response.content_type)], response.body)
+
+
+async def serve(host, port):
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info("serving %d datasets on http://%s:%d/datasets", len(DATASETS), host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=get_setting("API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=get_setting("API_PORT", 8502))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
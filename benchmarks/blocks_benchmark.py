@@ -0,0 +1,108 @@
+"""Times the block store behind the Gas Fee Market tab against pandas scans.
+
+For each history length, writes synthetic blocks to a Parquet file, loads
+them into the block store through BLOCKS_FILE, and charts ranges from an
+hour to the whole history. Each range is compared with filtering the
+blocks in a DataFrame and resampling them to the same resolution. Run from
+the repository root:
+
+    python benchmarks/blocks_benchmark.py --days 30 365 730
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DISK_CACHE", "false")
+os.environ.setdefault("INSTRUMENTATION", "false")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import blocks  # noqa: E402
+from synthetic_data import block_frame  # noqa: E402
+
+RANGES = {"hour": 3600, "day": 86400, "week": 7 * 86400, "month": 30 * 86400, "year": 365 * 86400, "all": None}
+
+FREQUENCIES = {"hour": "H", "day": "D"}
+
+
+def timed(func, repeat):
+
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def scan(df, start, end, resolution):
+
+    # What charting a range costs without the store: filter every block,
+    # then aggregate to the resolution the store picked.
+    df = df[(df.time >= pd.Timestamp(start, unit="s")) & (df.time <= pd.Timestamp(end, unit="s"))]
+    if resolution == "slot":
+        return df
+    return df.resample(FREQUENCIES[resolution], on="time").agg(
+        {"base_fee_per_gas": ["mean", "min", "max"], "priority_fee_per_gas": "mean", "gas_used": "mean"})
+
+
+def run_scale(days, repeat, max_points, workdir):
+
+    df = block_frame(days, np.random.default_rng(0))
+    path = os.path.join(workdir, "blocks-{}.parquet".format(days))
+    df.to_parquet(path, index=False)
+    df["time"] = pd.to_datetime(blocks.GENESIS_TIME + df.slot * 12, unit="s")
+    print("{} days, {:,} blocks".format(days, len(df)))
+
+    os.environ["BLOCKS_FILE"] = path
+
+    def load():
+        blocks._store = None
+        return blocks.get_block_store()
+
+    seconds, store = timed(load, repeat)
+    print("  {:<28} {:>10.4f}s".format("load and roll up", seconds))
+    rollup_bytes = sum(column.nbytes for rollup in store.rollups.values() for column in rollup[2:])
+    block_bytes = sum(column.nbytes for column in store.blocks)
+    print("  {:<28} {:>10.1f} MB blocks, {:.2f} MB rollups".format("memory", block_bytes / 1e6, rollup_bytes / 1e6))
+
+    # One hour of new blocks on top of the rest.
+    cut = int(np.searchsorted(store.blocks.slot, store.blocks.slot[-1] - 300))
+    older = blocks._build(store.source, blocks.Blocks(*(column[:cut] for column in store.blocks)))
+    newer = blocks.Blocks(*(column[cut:] for column in store.blocks))
+    seconds, _ = timed(lambda: blocks._ingest(older, newer), repeat)
+    print("  {:<28} {:>10.4f}s".format("ingest one hour", seconds))
+
+    first, last = blocks.time_range(store)
+    print("\n  {:<8} {:<10} {:>8} {:>12} {:>12}".format("range", "resolution", "points", "store ms", "scan ms"))
+    for name, span in RANGES.items():
+        start = first if span is None else max(first, last - span)
+        store_seconds, (resolution, df_series) = timed(
+            lambda: blocks.series(store, start, last, max_points), repeat)
+        scan_seconds, _ = timed(lambda: scan(df, start, last, resolution), repeat)
+        print("  {:<8} {:<10} {:>8} {:>12.2f} {:>12.2f}".format(
+            name, resolution, len(df_series), store_seconds * 1000, scan_seconds * 1000))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 365, 730])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per step; the fastest is reported")
+    parser.add_argument("--max-points", type=int, default=2000, help="points per chart trace")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for days in args.days:
+            run_scale(days, args.repeat, args.max_points, tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Times every loader, transform and figure build against synthetic data.
+
+Builds a SQLite stand-in with benchmarks/synthetic_data.py for each scale
+and runs the dashboard code against it, so no production database is
+needed. Run from the repository root:
+
+    python benchmarks/dashboard_benchmark.py --validators 10000 100000 1000000
+
+Outside a Streamlit script run st.experimental_memo does not cache, so
+every call below is a cold call.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DISK_CACHE", "false")
+os.environ.setdefault("INCREMENTAL_REFRESH", "false")
+os.environ.setdefault("INSTRUMENTATION", "false")
+os.environ.setdefault("PRECOMPUTED", "false")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datasets  # noqa: E402
+import db  # noqa: E402
+from charts import figure_json  # noqa: E402
+from synthetic_data import CLIENTS, build_database  # noqa: E402
+from transforms import gini_coefficients  # noqa: E402
+
+LOADERS = [
+    datasets.get_client_info,
+    datasets.get_cl_hosting_diversity_data,
+    datasets.get_first_proposal_clients,
+    datasets.get_proposals_by_client,
+    datasets.get_client_performance,
+    datasets.get_depositor_performance,
+    datasets.get_staking_client_distribution,
+    datasets.get_staking_client_diversity,
+    datasets.get_depositor_staking,
+    datasets.get_staking_overview,
+    datasets.get_weekly_validator_signups,
+    datasets.get_weekly_depositor_signups,
+    datasets.get_empty_block_stats,
+]
+
+AGGREGATE_LOADERS = [
+    datasets.get_client_performance_summary,
+    datasets.get_depositor_performance_summary,
+]
+
+FIGURES = [
+    ("box", datasets.get_client_performance_apr_quartiles, dict(x="Client", y="APR", color="Client")),
+    ("box", datasets.get_depositor_performance_apr_quartiles, dict(x="Depositor", y="APR", color="Depositor")),
+    ("treemap", datasets.get_cl_hosting_diversity_data,
+     dict(path=['hosting_provider_name', 'consensus_client'], values='total_nodes')),
+    ("pie", datasets.get_depositor_staking, dict(values='total_eth_deposited', names='depositor_label')),
+    ("line", datasets.get_first_proposal_clients,
+     dict(x='first_proposal_month', y='total_validators', color='predicted_client')),
+    ("bar", datasets.get_empty_block_stats, dict(x="day", y="empty_blocks")),
+]
+
+
+def timed(func, repeat):
+
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def use_database(path):
+
+    os.environ["DB_CONN_URL"] = "sqlite:///{}".format(path)
+    for engine in db.get_engine.cache_clear():
+        engine.dispose()
+
+
+def run_scale(validators, repeat, workdir):
+
+    path = os.path.join(workdir, "ethdash-{}.db".format(validators))
+    started = time.perf_counter()
+    build_database(path, validators)
+    print("\n{:,} validators (synthetic data built in {:.1f}s)".format(
+        validators, time.perf_counter() - started))
+    use_database(path)
+
+    results = []
+
+    def record(kind, name, seconds, result):
+        rows = len(result) if hasattr(result, "__len__") else None
+        results.append({"validators": validators, "kind": kind, "name": name, "seconds": seconds, "rows": rows})
+        print("  {:<10} {:<52} {:>10.4f}s {:>12}".format(kind, name, seconds, "" if rows is None else rows))
+
+    for func in LOADERS:
+        record("loader", func.__name__, *timed(func, repeat))
+
+    for backend in ("sql", "pandas", "sketch"):
+        os.environ["AGGREGATION_BACKEND"] = backend
+        for func in AGGREGATE_LOADERS:
+            record("aggregate", "{} [{}]".format(func.__name__, backend), *timed(func, repeat))
+    os.environ["AGGREGATION_BACKEND"] = "sql"
+
+    counts = datasets.get_staking_client_diversity()[CLIENTS].to_numpy()
+    record("transform", "gini_coefficients", *timed(lambda: gini_coefficients(counts), repeat))
+
+    for kind, func, params in FIGURES:
+        df = func()
+        seconds, spec = timed(lambda: figure_json(kind, df, **params), repeat)
+        record("figure", "{} {}".format(kind, func.__name__), seconds, df)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--validators", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per step; the fastest is reported")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--workdir", help="where to build the databases (default: a temporary directory)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = []
+        for validators in args.validators:
+            results += run_scale(validators, args.repeat, args.workdir or tmp)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Compares the per-row Gini coefficient with the batched one.
+
+Run from the repository root:
+
+    python benchmarks/gini_benchmark.py
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transforms import gini_coefficients  # noqa: E402
+
+CLIENTS = ['Lighthouse', 'Prysm', 'Teku', 'Nimbus', 'Lodestar']
+
+
+def gini(x):
+    # Previous implementation, applied row by row.
+    mad = np.abs(np.subtract.outer(x, x)).mean()
+    rmad = mad / np.mean(x)
+    return 0.5 * rmad
+
+
+def per_row(df):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return df.apply(lambda x: gini(list(x[CLIENTS])), axis=1)
+
+
+def batched(df):
+    return pd.Series(gini_coefficients(df[CLIENTS].to_numpy()), index=df.index)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print("{:>10} {:>12} {:>12} {:>9}".format("entities", "per-row s", "batched s", "speedup"))
+    for entities in (100, 1000, 10000, 100000):
+        df = pd.DataFrame(rng.integers(0, 500, size=(entities, len(CLIENTS))), columns=CLIENTS)
+        df.iloc[0] = 0
+
+        np.testing.assert_allclose(per_row(df), batched(df), rtol=1e-12, equal_nan=True)
+
+        repeat = max(1, 10000 // entities)
+        per_row_seconds = timeit.timeit(lambda: per_row(df), number=repeat) / repeat
+        batched_seconds = timeit.timeit(lambda: batched(df), number=repeat) / repeat
+        print("{:>10} {:>12.5f} {:>12.5f} {:>8.0f}x".format(
+            entities, per_row_seconds, batched_seconds, per_row_seconds / batched_seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Profiles the import time of the dashboard modules with -X importtime.
+
+Each run imports the modules the app script imports in a fresh
+interpreter and reports the median cumulative time of the heaviest
+packages. It then lists the heavy packages that are deferred until a tab
+needs them. Run from the repository root:
+
+    python benchmarks/import_benchmark.py --repeat 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_MODULES = ["blocks", "charts", "config", "datasets", "instrumentation", "tables"]
+
+# Imported on first use rather than at startup.
+DEFERRED = ["plotly.express", "sqlalchemy", "pymysql"]
+
+
+def import_times(modules):
+
+    # {module: cumulative microseconds} for one cold interpreter.
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Top-level packages only, e.g. "pandas" but not "pandas.core".
+        if "." not in name.strip():
+            times[name.strip()] = max(times.get(name.strip(), 0), int(cumulative))
+    return times
+
+
+def loaded_modules(modules):
+
+    result = subprocess.run(
+        [sys.executable, "-c", "import sys, {}; print(' '.join(sys.modules))".format(", ".join(modules))],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    return set(result.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="cold interpreters to start; medians are reported")
+    parser.add_argument("--top", type=int, default=12, help="number of packages to show")
+    args = parser.parse_args()
+
+    runs = [import_times(APP_MODULES) for _ in range(args.repeat)]
+    medians = {name: statistics.median(run.get(name, 0) for run in runs) for name in runs[0]}
+
+    own = sum(medians.get(name, 0) for name in APP_MODULES)
+    print("import {}: {:.0f} ms (median of {})".format(", ".join(APP_MODULES), own / 1000, args.repeat))
+    print("\n{:<28} {:>10}".format("package", "cumul. ms"))
+    for name, micros in sorted(medians.items(), key=lambda item: -item[1])[:args.top]:
+        print("{:<28} {:>10.1f}".format(name, micros / 1000))
+
+    loaded = loaded_modules(APP_MODULES)
+    print("\ndeferred until first use:")
+    for name in DEFERRED:
+        print("  {:<26} {}".format(name, "imported at startup" if name in loaded else "ok"))
+
+
+if __name__ == "__main__":
+    main()
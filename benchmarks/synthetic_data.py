@@ -0,0 +1,165 @@
+"""Generates a SQLite stand-in for every table the dashboard reads.
+
+Sizes scale with the number of validators; the small metadata tables keep
+roughly production-like sizes. Run from the repository root:
+
+    python benchmarks/synthetic_data.py /tmp/ethdash.db --validators 100000
+"""
+import argparse
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+CLIENTS = ['Lighthouse', 'Lodestar', 'Nimbus', 'Prysm', 'Teku']
+EXECUTION_CLIENTS = ['geth', 'nethermind', 'besu', 'erigon', '']
+DEPOSITOR_TYPES = ['CEX', 'LSD', 'Staking Pool', 'Whale', None]
+CHUNK_ROWS = 500000
+NOW = pd.Timestamp('2022-12-01 06:00:00')
+GENESIS_TIME = 1606824023
+
+
+def _create(conn, table, columns):
+
+    conn.execute("DROP TABLE IF EXISTS {}".format(table))
+    conn.execute("CREATE TABLE {} ({})".format(table, ", ".join(
+        "{} {}".format(name, sql_type) for name, sql_type in columns)))
+
+
+def _insert(conn, table, df):
+
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].dt.strftime('%Y-%m-%d %H:%M:%S')
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    conn.executemany("INSERT INTO {} VALUES ({})".format(
+        table, ", ".join("?" * len(df.columns))), rows)
+
+
+def _put(conn, table, df, types):
+
+    _create(conn, table, [(column, types.get(column, "")) for column in df.columns])
+    _insert(conn, table, df)
+
+
+def _performance_table(conn, table, label_column, labels, validators, rng):
+
+    _create(conn, table, [("validator", "INTEGER"), (label_column, "TEXT"), ("apr", "REAL")])
+    for start in range(0, validators, CHUNK_ROWS):
+        size = min(CHUNK_ROWS, validators - start)
+        apr = rng.normal(0.045, 0.012, size)
+        apr[rng.random(size) < 0.001] = np.nan
+        _insert(conn, table, pd.DataFrame({
+            "validator": np.arange(start, start + size),
+            label_column: rng.choice(labels, size),
+            "apr": apr,
+        }))
+
+
+def block_frame(days, rng) -> pd.DataFrame:
+
+    # One block per 12 second slot up to NOW, at most since genesis, with
+    # 1% of slots missed. The
+    # base fee follows a mean-reverting walk with a daily cycle (in wei),
+    # the priority fee and gas used are noise around typical values.
+    last_slot = (int(NOW.timestamp()) - GENESIS_TIME) // 12
+    slot = np.arange(max(last_slot - days * 7200 + 1, 0), last_slot + 1)
+    slot = slot[rng.random(len(slot)) >= 0.01]
+
+    walk = np.zeros(len(slot))
+    shocks = rng.normal(0, 0.02, len(slot))
+    for start in range(0, len(slot), 5000):
+        # AR(1) with coefficient 0.999, solved in chunks short enough that
+        # 0.999 ** length doesn't underflow.
+        end = min(start + 5000, len(slot))
+        decay = 0.999 ** np.arange(1, end - start + 1)
+        previous = walk[start - 1] if start else 0.0
+        walk[start:end] = decay * (previous + np.cumsum(shocks[start:end] / decay))
+    cycle = 0.3 * np.sin(2 * np.pi * ((GENESIS_TIME + slot * 12) % 86400) / 86400)
+
+    return pd.DataFrame({
+        "slot": slot,
+        "base_fee_per_gas": (np.exp(np.log(15) + walk + cycle) * 1e9).astype(np.int64),
+        "priority_fee_per_gas": (rng.lognormal(np.log(1.5), 0.5, len(slot)) * 1e9).astype(np.int64),
+        "gas_used": np.clip(rng.normal(15e6, 6e6, len(slot)), 0, 30e6).astype(np.int64),
+    })
+
+
+def build_database(path, validators, seed=0, block_days=30):
+
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(path)
+
+    depositors = ['Depositor {}'.format(i) for i in range(max(20, min(validators // 500, 2000)))]
+    entities = ['Entity {}'.format(i) for i in range(max(20, validators // 100))]
+    providers = ['AS{} Provider'.format(i) for i in range(400)]
+    months = pd.date_range('2020-12-01', NOW, freq='MS')
+    weeks = pd.date_range('2020-11-02', NOW, freq='W-MON')
+    days = pd.date_range(NOW.normalize() - pd.Timedelta(days=90), NOW.normalize(), freq='D')
+
+    _put(conn, "ui_client_info", pd.DataFrame(
+        [(c, e, int(rng.integers(1, 3000)), NOW) for c in CLIENTS for e in EXECUTION_CLIENTS],
+        columns=["consensus_client", "execution_client", "total_nodes", "last_updated"]),
+        {"last_updated": "TIMESTAMP"})
+    _put(conn, "ui_consensus_hosting_info", pd.DataFrame(
+        [(c, p, int(rng.pareto(1.2) * 20) + 1, NOW) for c in CLIENTS for p in providers],
+        columns=["consensus_client", "hosting_provider_name", "total_nodes", "last_updated"]),
+        {"last_updated": "TIMESTAMP"})
+    _put(conn, "ui_validator_first_proposals", pd.DataFrame(
+        [(m, c, int(rng.integers(10, validators // 100 + 20)), NOW) for m in months for c in CLIENTS],
+        columns=["first_proposal_month", "predicted_client", "total_validators", "last_updated"]),
+        {"first_proposal_month": "TIMESTAMP", "last_updated": "TIMESTAMP"})
+    _put(conn, "ui_proposals_by_client", pd.DataFrame(
+        [(m, c, int(rng.integers(100, validators // 10 + 200))) for m in months for c in CLIENTS],
+        columns=["proposal_month", "predicted_client", "total_proposals"]),
+        {"proposal_month": "TIMESTAMP"})
+
+    _performance_table(conn, "ui_client_performance", "client", CLIENTS, validators, rng)
+    _performance_table(conn, "ui_depositor_performance", "depositor_label", depositors, validators, rng)
+
+    _put(conn, "ui_staking_client_distribution", pd.DataFrame(
+        [(e, c, int(rng.integers(0, 200))) for e in entities for c in CLIENTS],
+        columns=["staking_entity", "client", "tot_validators"]), {})
+    _put(conn, "ui_depositor_staking", pd.DataFrame({
+        "depositor_label": depositors,
+        "depositor_type": rng.choice(DEPOSITOR_TYPES, len(depositors)),
+        "total_eth_deposited": rng.uniform(32, 1e6, len(depositors)),
+        "eth_deposited_last_30days": rng.uniform(0, 1e4, len(depositors)),
+    }), {})
+    _put(conn, "ui_staking_overview", pd.DataFrame(
+        [(len(depositors) * 40, validators, validators * 32.0, 0.02, 0.03)],
+        columns=["total_depositors", "num_validators", "eth_deposited", "depositor_change", "validator_change"]), {})
+    _put(conn, "dn_validators_signup_weekly", pd.DataFrame({
+        "first_deposit_week": weeks,
+        "validators_signed_up": rng.integers(10, validators // 50 + 20, len(weeks)),
+    }), {"first_deposit_week": "TIMESTAMP"})
+    _put(conn, "dn_depositors_signup_weekly", pd.DataFrame({
+        "week": weeks,
+        "depositor_count": rng.integers(1, validators // 500 + 10, len(weeks)),
+    }), {"week": "TIMESTAMP"})
+    _put(conn, "dn_block_stats_empty_missed", pd.DataFrame({
+        "day": days,
+        "empty_blocks": rng.integers(0, 30, len(days)),
+        "missed_slots": rng.integers(0, 100, len(days)),
+    }), {"day": "TIMESTAMP"})
+    _create(conn, "dn_block_gas", [("slot", "INTEGER PRIMARY KEY"), ("base_fee_per_gas", "INTEGER"),
+                                   ("priority_fee_per_gas", "INTEGER"), ("gas_used", "INTEGER")])
+    _insert(conn, "dn_block_gas", block_frame(block_days, rng))
+
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--validators", type=int, default=100000)
+    parser.add_argument("--block-days", type=int, default=30, help="days of blocks in dn_block_gas")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    build_database(args.path, args.validators, args.seed, args.block_days)
+
+
+if __name__ == "__main__":
+    main()
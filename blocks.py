@@ -0,0 +1,317 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from cache import _host_lock, read_entry, read_meta, write_entry
+from config import get_setting
+from db import DatabaseUnavailable, is_schema_error, stream_query
+from instrumentation import measure
+
+logger = logging.getLogger(__name__)
+
+# Since the merge every block has its own 12 second beacon chain slot.
+GENESIS_TIME = 1606824023
+SECONDS_PER_SLOT = 12
+
+# Finest first. The slot resolution is the blocks themselves.
+RESOLUTIONS = {"slot": SECONDS_PER_SLOT, "hour": 3600, "day": 86400}
+
+COLUMNS = ["slot", "base_fee_per_gas", "priority_fee_per_gas", "gas_used"]
+
+# Per-block columns, sorted by slot: fees in gwei as float32, which keeps
+# about 7 significant digits, and gas used as int32.
+Blocks = namedtuple("Blocks", ["slot", "base_fee", "priority_fee", "gas_used"])
+
+# Dense per-bucket aggregates; bucket i covers the epoch seconds
+# [(origin + i) * seconds, (origin + i + 1) * seconds).
+Rollup = namedtuple("Rollup", ["seconds", "origin", "blocks", "base_fee_sum", "base_fee_min",
+                               "base_fee_max", "priority_fee_sum", "gas_used_sum"])
+
+BlockStore = namedtuple("BlockStore", ["source", "blocks", "rollups", "refreshed_at"])
+
+_store = None
+_lock = threading.Lock()
+_snapshot_lock = threading.Lock()
+
+
+def _times(slot) -> np.ndarray:
+
+    return GENESIS_TIME + np.asarray(slot, dtype=np.int64) * SECONDS_PER_SLOT
+
+
+def _first_slot_at(timestamp):
+
+    # As int32 like the slots: searchsorted would otherwise cast every slot
+    # to the type of the value it looks for.
+    return np.int32(-(-(int(timestamp) - GENESIS_TIME) // SECONDS_PER_SLOT))
+
+
+def _compact(df) -> Blocks:
+
+    df = df.sort_values("slot").drop_duplicates("slot", keep="last")
+    return Blocks(
+        df.slot.to_numpy(dtype=np.int32),
+        (df.base_fee_per_gas.to_numpy(dtype=np.float64) / 1e9).astype(np.float32),
+        (df.priority_fee_per_gas.to_numpy(dtype=np.float64) / 1e9).astype(np.float32),
+        df.gas_used.to_numpy(dtype=np.int32))
+
+
+def _concat(parts) -> Blocks:
+
+    return Blocks(*(np.concatenate(arrays) for arrays in zip(*parts)))
+
+
+def _rollup(blocks, seconds, origin=None) -> Rollup:
+
+    # The blocks are sorted, so each bucket is a contiguous run and every
+    # aggregate is one ufunc.reduceat over the runs.
+    bucket = _times(blocks.slot) // seconds
+    if not len(bucket):
+        empty = np.empty(0)
+        return Rollup(seconds, origin or 0, empty.astype(np.int32), empty, empty.astype(np.float32),
+                      empty.astype(np.float32), empty, empty.astype(np.int64))
+
+    origin = int(bucket[0]) if origin is None else origin
+    starts = np.flatnonzero(np.diff(bucket, prepend=bucket[0] - 1))
+    at = bucket[starts] - origin
+    size = int(bucket[-1]) - origin + 1
+
+    def dense(values, fill, dtype):
+        result = np.full(size, fill, dtype=dtype)
+        result[at] = values
+        return result
+
+    return Rollup(
+        seconds, origin,
+        dense(np.diff(np.append(starts, len(bucket))), 0, np.int32),
+        dense(np.add.reduceat(blocks.base_fee, starts, dtype=np.float64), 0, np.float64),
+        dense(np.minimum.reduceat(blocks.base_fee, starts), np.nan, np.float32),
+        dense(np.maximum.reduceat(blocks.base_fee, starts), np.nan, np.float32),
+        dense(np.add.reduceat(blocks.priority_fee, starts, dtype=np.float64), 0, np.float64),
+        dense(np.add.reduceat(blocks.gas_used, starts, dtype=np.int64), 0, np.int64))
+
+
+def _extend(rollup, blocks, new_from) -> Rollup:
+
+    # Rebuilds the buckets from the one holding blocks[new_from] onward;
+    # the buckets before it can't have changed.
+    end = rollup.origin + len(rollup.blocks)
+    if not len(rollup.blocks):
+        return _rollup(blocks, rollup.seconds)
+
+    origin = min(int(_times(blocks.slot[new_from]) // rollup.seconds), end)
+    first = int(np.searchsorted(blocks.slot, _first_slot_at(origin * rollup.seconds)))
+    tail = _rollup(Blocks(*(column[first:] for column in blocks)), rollup.seconds, origin)
+    keep = origin - rollup.origin
+    return Rollup(rollup.seconds, rollup.origin, *(
+        np.concatenate([old[:keep], new]) for old, new in zip(rollup[2:], tail[2:])))
+
+
+def _ingest(store, new) -> BlockStore:
+
+    # Appends blocks past the last slot of store and updates its rollups.
+    if new is None or not len(new.slot):
+        return store._replace(refreshed_at=time.time())
+
+    if len(store.blocks.slot):
+        new = Blocks(*(column[new.slot > store.blocks.slot[-1]] for column in new))
+    new_from = len(store.blocks.slot)
+    blocks = _concat([store.blocks, new])
+    rollups = {name: _extend(rollup, blocks, new_from) for name, rollup in store.rollups.items()}
+    return BlockStore(store.source, blocks, rollups, time.time())
+
+
+def _build(source, blocks) -> BlockStore:
+
+    return BlockStore(source, blocks, {name: _rollup(blocks, seconds)
+                                       for name, seconds in RESOLUTIONS.items() if name != "slot"}, 0)
+
+
+def _empty(source) -> BlockStore:
+
+    return _build(source, _compact(pd.DataFrame({column: pd.Series(dtype="int64") for column in COLUMNS})))
+
+
+def _source():
+
+    # Blocks come from BLOCKS_FILE when it is set, else from BLOCKS_TABLE.
+    path = get_setting("BLOCKS_FILE")
+    return ["file", path] if path else ["table", get_setting("BLOCKS_TABLE", "dn_block_gas")]
+
+
+def _read_file(path, after_slot) -> pd.DataFrame:
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        return pd.read_parquet(path, columns=COLUMNS, filters=[("slot", ">", after_slot)])
+    if extension == ".csv":
+        df = pd.read_csv(path, usecols=COLUMNS)
+    else:
+        df = pd.read_feather(path, columns=COLUMNS)
+    return df[df.slot > after_slot]
+
+
+def _fetch(source, after_slot):
+
+    # Blocks past after_slot, compacted chunk by chunk, or None when the
+    # table or file doesn't exist (yet).
+    kind, name = source
+    try:
+        if kind == "file":
+            chunks = [_read_file(name, after_slot)]
+        else:
+            chunks = stream_query("""
+            SELECT slot, base_fee_per_gas, priority_fee_per_gas, gas_used
+            FROM {table}
+            WHERE slot > :after_slot
+            ORDER BY slot
+            """.format(table=name), params={"after_slot": after_slot})
+        return _concat([_compact(chunk) for chunk in chunks] or [_empty(source).blocks])
+    except Exception as error:
+        if not (isinstance(error, FileNotFoundError) or is_schema_error(error)):
+            raise
+        logger.warning("no blocks to load from %s %s: %s", kind, name, error)
+        return None
+
+
+def _read_snapshot(source):
+
+    meta = read_meta("blocks")
+    df = read_entry("blocks", zero_copy=True) if meta and meta.get("source") == source else None
+    if df is None:
+        return None
+    return _build(source, Blocks(*(df[column].to_numpy() for column in Blocks._fields)))
+
+
+def _write_snapshot(store):
+
+    # Rewrites the whole history, so it runs in a background thread, at
+    # most every BLOCKS_SNAPSHOT_SECONDS and in one process on the host.
+    # A process only reads the snapshot when it starts and fetches the
+    # blocks past it, so a snapshot a little behind costs one larger fetch.
+    if not _snapshot_lock.acquire(blocking=False):
+        return
+    interval = get_setting("BLOCKS_SNAPSHOT_SECONDS", 3600)
+
+    def run():
+        try:
+            with _host_lock("blocks", blocking=False) as acquired:
+                meta = read_meta("blocks")
+                if not acquired or (meta is not None and meta.get("source") == store.source
+                                    and time.time() - meta["created_at"] < interval):
+                    return
+                write_entry("blocks", pd.DataFrame(store.blocks._asdict()),
+                            interval, [store.source[1]], source=store.source)
+        except OSError:
+            logger.warning("could not write the block snapshot", exc_info=True)
+        finally:
+            _snapshot_lock.release()
+
+    threading.Thread(target=run, name="blocks-snapshot", daemon=True).start()
+
+
+def get_block_store() -> BlockStore:
+
+    # The blocks and their rollups, shared by every session of the process.
+    # Every BLOCKS_REFRESH_SECONDS one caller fetches the blocks past the
+    # last slot and swaps in an extended store; readers never see a
+    # partially updated one. A process starts from the snapshot on disk
+    # (see _write_snapshot), so only the first one loads the full history.
+    # Without a table or file to read, the store stays empty and is
+    # checked again on the next refresh.
+    global _store
+
+    store = _store
+    if store is not None and store.source == _source() and \
+            time.time() - store.refreshed_at < get_setting("BLOCKS_REFRESH_SECONDS", 600):
+        return store
+
+    with _lock:
+        if _store is not store:
+            return _store
+
+        source = _source()
+        if store is None or store.source != source:
+            store = None
+            if get_setting("DISK_CACHE", True):
+                store = _read_snapshot(source)
+            store = store or _empty(source)
+
+        after_slot = int(store.blocks.slot[-1]) if len(store.blocks.slot) else -1
+        try:
+            new = _fetch(source, after_slot)
+        except DatabaseUnavailable as error:
+            if not len(store.blocks.slot):
+                raise
+            logger.warning("serving the blocks up to slot %d: %s", after_slot, error)
+            new = None
+
+        _store = _ingest(store, new)
+        if new is not None and len(new.slot) and get_setting("DISK_CACHE", True):
+            _write_snapshot(_store)
+        return _store
+
+
+def time_range(store):
+
+    # Epoch seconds of the first and last block.
+    times = _times(store.blocks.slot[[0, -1]])
+    return int(times[0]), int(times[1])
+
+
+def series(store, start, end, max_points):
+
+    # Fees and gas used from start to end (epoch seconds) at the finest
+    # resolution that shows the range in at most max_points points, so a
+    # wide view reads the coarse rollups instead of every block. The cost
+    # depends on max_points, not on the number of blocks in the range.
+    # Returns the resolution and one row per block or bucket; buckets
+    # without blocks have missing fees, so charts show the gap.
+    slot = store.blocks.slot
+    first, last = np.searchsorted(slot, np.array([_first_slot_at(start), _first_slot_at(end + 1)]))
+    if last - first <= max_points:
+        blocks = Blocks(*(column[first:last] for column in store.blocks))
+        return "slot", pd.DataFrame({
+            "time": pd.to_datetime(_times(blocks.slot), unit="s"),
+            "blocks": 1,
+            "base_fee": blocks.base_fee,
+            "base_fee_min": blocks.base_fee,
+            "base_fee_max": blocks.base_fee,
+            "priority_fee": blocks.priority_fee,
+            "gas_used": blocks.gas_used,
+        })
+
+    # The coarsest rollup (day) is used even when it needs more points.
+    name, rollup = next(((name, rollup) for name, rollup in store.rollups.items()
+                         if end // rollup.seconds - start // rollup.seconds < max_points),
+                        list(store.rollups.items())[-1])
+    seconds = rollup.seconds
+    lo = max(start // seconds - rollup.origin, 0)
+    hi = min(end // seconds - rollup.origin + 1, len(rollup.blocks))
+    window = Rollup(seconds, rollup.origin + lo, *(column[lo:hi] for column in rollup[2:]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return name, pd.DataFrame({
+            "time": pd.to_datetime((window.origin + np.arange(len(window.blocks))) * seconds, unit="s"),
+            "blocks": window.blocks,
+            "base_fee": window.base_fee_sum / window.blocks,
+            "base_fee_min": window.base_fee_min,
+            "base_fee_max": window.base_fee_max,
+            "priority_fee": window.priority_fee_sum / window.blocks,
+            "gas_used": window.gas_used_sum / window.blocks,
+        })
+
+
+def fee_series(start, end, max_points=None):
+
+    # series() over the process's block store, instrumented like a loader.
+    max_points = max_points or get_setting("CHART_MAX_POINTS_PER_TRACE", 2000)
+    with measure("loader", "fee_series") as frame:
+        resolution, df = series(get_block_store(), start, end, max_points)
+        frame["cache"] = resolution
+        frame["rows"] = len(df)
+    return resolution, df
@@ -0,0 +1,573 @@
+import contextlib
+import functools
+import glob
+import hashlib
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-flight within the process only
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+
+from config import get_setting
+from db import DatabaseUnavailable, run_query
+from instrumentation import instrument_loader, mark_cache_source, measure
+from transforms import compact_dtypes
+
+logger = logging.getLogger(__name__)
+
+_flight_locks = defaultdict(threading.Lock)
+_pending = {}
+_pending_lock = threading.Lock()
+_attached = {}
+_published = {}
+_expired_versions = set()
+
+
+def _cache_dir():
+
+    path = get_setting("DISK_CACHE_DIR", ".cache/datasets")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _entry_paths(name):
+
+    base = os.path.join(_cache_dir(), name)
+    return base + ".arrow", base + ".json"
+
+
+def _entry_name(func, args, kwargs, settings=()):
+
+    # The source hash keeps a redeploy with a changed query from reading
+    # results written by the previous version, and the values of settings
+    # the result depends on keep e.g. another backend's result from being
+    # served.
+    key = repr((inspect.getsource(func), args, sorted(kwargs.items()),
+                [get_setting(setting) for setting in settings]))
+    return "{}-{}".format(func.__name__, hashlib.sha1(key.encode()).hexdigest()[:12])
+
+
+def read_meta(name):
+
+    _, meta_path = _entry_paths(name)
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_table(path, zero_copy=False):
+
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+
+    if zero_copy:
+        # One block per column lets numeric columns without nulls (see
+        # write_table) stay views of the memory-mapped file, shared through
+        # the page cache by every process that maps it.
+        return table.to_pandas(split_blocks=True)
+    return table.to_pandas()
+
+
+def write_table(path, df):
+
+    suffix = ".{}-{}.tmp".format(os.getpid(), threading.get_ident())
+    table = pa.Table.from_pandas(df)
+    for column in df.columns:
+        # from_pandas turns NaN into nulls, and a column with nulls is
+        # copied on read. Written as plain floats, NaN stays NaN and the
+        # column stays a view of the file.
+        if df[column].dtype.kind == "f" and isinstance(df[column].dtype, np.dtype):
+            index = table.schema.get_field_index(str(column))
+            values = pa.array(df[column].to_numpy(), from_pandas=False)
+            table = table.set_column(index, table.field(index), values)
+    with pa.OSFile(path + suffix, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(path + suffix, path)
+
+
+def read_entry(name, max_age=None, zero_copy=False):
+
+    data_path, meta_path = _entry_paths(name)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if max_age is not None and time.time() - meta["created_at"] > max_age:
+            return None
+        return read_table(data_path, zero_copy)
+    except (OSError, ValueError, KeyError, pa.ArrowInvalid):
+        return None
+
+
+def write_entry(name, df, ttl, tables=(), **extra_meta):
+
+    data_path, meta_path = _entry_paths(name)
+    write_table(data_path, df)
+
+    meta = {
+        "name": name,
+        "created_at": time.time(),
+        "ttl": ttl,
+        "tables": list(tables),
+        "rows": len(df),
+        "bytes": os.path.getsize(data_path),
+    }
+    meta.update(extra_meta)
+    suffix = ".{}-{}.tmp".format(os.getpid(), threading.get_ident())
+    with open(meta_path + suffix, "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + suffix, meta_path)
+
+
+def evict():
+
+    # Drops entries more than STALE_MAX_AGE past their ttl, then the oldest
+    # ones until the store fits DISK_CACHE_MAX_BYTES. Expired entries are
+    # kept that long so they can be served while they are reloaded, or
+    # while the database is unavailable.
+    entries = []
+    now = time.time()
+    for meta_path in glob.glob(os.path.join(_cache_dir(), "*.json")):
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if now - meta["created_at"] > meta["ttl"] + get_setting("STALE_MAX_AGE", 86400):
+            _remove_entry(meta["name"])
+        else:
+            entries.append(meta)
+
+    total_bytes = sum(meta["bytes"] for meta in entries)
+    max_bytes = get_setting("DISK_CACHE_MAX_BYTES", 1 << 30)
+    for meta in sorted(entries, key=lambda meta: meta["created_at"]):
+        if total_bytes <= max_bytes:
+            break
+        _remove_entry(meta["name"])
+        total_bytes -= meta["bytes"]
+
+
+def _remove_entry(name):
+
+    for path in _entry_paths(name):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _compact(name, df):
+
+    with measure("dataset", name) as frame:
+        frame["bytes_before"] = int(df.memory_usage(index=True, deep=True).sum())
+        df = compact_dtypes(df)
+        frame["rows"] = len(df)
+        frame["bytes"] = int(df.memory_usage(index=True, deep=True).sum())
+
+    logger.info("%s: %d rows, %d -> %d bytes after dtype compaction",
+                name, len(df), frame.get("bytes_before", 0), frame.get("bytes", 0))
+    return df
+
+
+@functools.lru_cache(maxsize=8)
+def read_manifest(directory, version):
+
+    with open(os.path.join(directory, version, "manifest.json")) as f:
+        return json.load(f)
+
+
+def read_artifact(name):
+
+    # Returns the frame published for name by the last run of precompute.py,
+    # or None when there is none or it is older than ARTIFACTS_MAX_AGE.
+    if not get_setting("PRECOMPUTED", True):
+        return None
+
+    directory = get_setting("ARTIFACTS_DIR", ".cache/artifacts")
+    try:
+        with open(os.path.join(directory, "CURRENT")) as f:
+            version = f.read().strip()
+        manifest = read_manifest(directory, version)
+    except (OSError, ValueError):
+        return None
+
+    if name not in manifest["datasets"]:
+        return None
+    if time.time() - manifest["created_at"] > get_setting("ARTIFACTS_MAX_AGE", 172800):
+        if version not in _expired_versions:
+            _expired_versions.add(version)
+            logger.warning("artifacts %s are out of date, loading datasets directly", version)
+        return None
+
+    published = _published.get(name)
+    if published is not None and published[0] == version:
+        return published[1]
+    try:
+        df = read_table(os.path.join(directory, version, name + ".arrow"), zero_copy=True)
+    except (OSError, pa.ArrowInvalid):
+        logger.warning("could not read artifact %s of %s", name, version, exc_info=True)
+        return None
+    _published[name] = (version, df)
+    return df
+
+
+def _precomputed(load):
+
+    # Serves the artifact of a dataset, when one is published, instead of
+    # loading it.
+    @functools.wraps(load)
+    def read(*args, **kwargs) -> pd.DataFrame:
+        if not args and not kwargs:
+            df = read_artifact(load.__name__)
+            if df is not None:
+                mark_cache_source("artifact")
+                return df
+        return load(*args, **kwargs)
+
+    return read
+
+
+@contextlib.contextmanager
+def _host_lock(name, blocking=True):
+
+    # An exclusive lock on a file next to the entry, shared by every process
+    # on the host. Yields whether it was acquired, which is always the case
+    # when blocking.
+    if fcntl is None:
+        yield True
+        return
+    with open(os.path.join(_cache_dir(), name + ".lock"), "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def _single_flight(name):
+
+    # Serializes refreshes of one entry across threads and processes.
+    with _flight_locks[name], _host_lock(name):
+        yield
+
+
+def _coalesce(name, fetch):
+
+    # Runs fetch once for the callers that miss name at the same time: the
+    # first one fetches, the others wait for it and get a copy of its
+    # result (or its exception).
+    with _pending_lock:
+        future = _pending.get(name)
+        waiting = future is not None
+        if not waiting:
+            future = _pending[name] = Future()
+
+    if waiting:
+        df = future.result()
+        mark_cache_source("coalesced")
+        return df.copy()
+
+    try:
+        future.set_result(fetch())
+    except BaseException as error:
+        future.set_exception(error)
+    finally:
+        with _pending_lock:
+            del _pending[name]
+    return future.result()
+
+
+def _state(meta, ttl):
+
+    # "fresh", "stale" (serve it, refresh it in the background) or "missing".
+    if meta is None:
+        return "missing"
+
+    age = time.time() - meta["created_at"]
+    if not get_setting("STALE_WHILE_REVALIDATE", True):
+        return "fresh" if age <= ttl else "missing"
+
+    # Refreshing a random amount early spreads out the refreshes of entries
+    # that were loaded together, e.g. by replicas started at the same time.
+    if age <= ttl * (1 - get_setting("STALE_REFRESH_JITTER", 0.1) * random.random()):
+        return "fresh"
+    if age <= ttl + get_setting("STALE_MAX_AGE", 86400):
+        return "stale"
+    return "missing"
+
+
+def _revalidate(name, meta, refresh):
+
+    # Runs refresh in a background thread unless a refresh of the entry is
+    # already running in this process or another one on the host.
+    lock = _flight_locks[name]
+    if not lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            with _host_lock(name, blocking=False) as acquired:
+                # Skip it if another process has refreshed it in the meantime.
+                latest = read_meta(name)
+                if not acquired or latest is None or latest["created_at"] != meta["created_at"]:
+                    return
+                refresh()
+        except Exception:
+            logger.warning("background refresh of %s failed, serving the stale entry",
+                           name, exc_info=True)
+        finally:
+            lock.release()
+
+    threading.Thread(target=run, name="revalidate-{}".format(name), daemon=True).start()
+
+
+def _attach(name, max_age=None):
+
+    # Returns the process-wide frame mapped from the entry, mapping it again
+    # only when another process has rewritten it.
+    meta = read_meta(name)
+    if meta is None or (max_age is not None and time.time() - meta["created_at"] > max_age):
+        return None
+
+    attached = _attached.get(name)
+    if attached is not None and attached[0] == meta["created_at"]:
+        mark_cache_source("shared")
+        return attached[1]
+
+    df = read_entry(name, zero_copy=True)
+    if df is not None:
+        mark_cache_source("disk")
+        _attached[name] = (meta["created_at"], df)
+    return df
+
+
+def loader(ttl, tables=(), shared=False, settings=()):
+
+    # Memoizes a DataFrame loader in process memory and, with DISK_CACHE
+    # enabled, in an Arrow IPC file store that survives restarts. The memo
+    # TTL is capped so a process re-reads the disk tier, which enforces ttl.
+    #
+    # With STALE_WHILE_REVALIDATE, an entry past its ttl is still served for
+    # up to STALE_MAX_AGE seconds while a single background thread reloads
+    # it, so only the first load waits for the database.
+    #
+    # settings names the settings the result depends on; each combination
+    # of their values is cached separately.
+    #
+    # With CACHE_FALLBACK, when the database is unavailable (see
+    # db.DatabaseUnavailable) the last cached result is served whatever its
+    # age, as long as it is still on disk.
+    #
+    # shared=True is meant for large read-only frames: instead of the memo,
+    # which hands every caller its own copy, all sessions and all processes
+    # on the host attach to the memory-mapped entry, and only one of them
+    # queries the database when it expires. Callers must not modify the
+    # returned frame.
+    def decorator(func):
+
+        disk_cache = get_setting("DISK_CACHE", True)
+        use_shared = shared and disk_cache and get_setting("SHARED_CACHE", True)
+
+        def fetch(name, args, kwargs):
+            mark_cache_source("database")
+            try:
+                df = func(*args, **kwargs)
+            except DatabaseUnavailable as error:
+                df = read_entry(name) if disk_cache and get_setting("CACHE_FALLBACK", True) else None
+                if df is None:
+                    raise
+                logger.warning("serving the last cached %s: %s", name, error)
+                mark_cache_source("fallback")
+                return df
+            if get_setting("COMPACT_DTYPES", True):
+                df = _compact(func.__name__, df)
+
+            if disk_cache:
+                try:
+                    write_entry(name, df, ttl, tables)
+                    evict()
+                except (OSError, pa.ArrowException):
+                    logger.warning("could not cache %s on disk", name, exc_info=True)
+            return df
+
+        def refresh(name, args, kwargs):
+            fetch(name, args, kwargs)
+            if not use_shared:
+                # Drop the stale result this process memoized.
+                memoized.clear()
+
+        @functools.wraps(func)
+        def load(*args, **kwargs) -> pd.DataFrame:
+            name = _entry_name(func, args, kwargs, settings)
+            if disk_cache:
+                meta = read_meta(name)
+                state = _state(meta, ttl)
+                df = read_entry(name) if state != "missing" else None
+                if df is not None:
+                    mark_cache_source("disk")
+                    if state == "stale":
+                        _revalidate(name, meta, lambda: refresh(name, args, kwargs))
+                    return df
+
+            # The memo doesn't coalesce concurrent misses, e.g. prefetch
+            # threads loading two views of one base, so one thread per
+            # entry fetches and the others read what it wrote, or without
+            # the disk tier, copy what it returned.
+            if not disk_cache:
+                return _coalesce(name, lambda: fetch(name, args, kwargs))
+            with _flight_locks[name]:
+                df = read_entry(name, max_age=ttl)
+                if df is not None:
+                    mark_cache_source("disk")
+                    return df
+                return fetch(name, args, kwargs)
+
+        @functools.wraps(func)
+        def load_shared(*args, **kwargs) -> pd.DataFrame:
+            name = _entry_name(func, args, kwargs, settings)
+            meta = read_meta(name)
+            state = _state(meta, ttl)
+            df = _attach(name) if state != "missing" else None
+            if df is not None:
+                if state == "stale":
+                    _revalidate(name, meta, lambda: refresh(name, args, kwargs))
+                return df
+
+            with _single_flight(name):
+                # Another process may have refreshed it while we waited.
+                df = _attach(name, ttl)
+                if df is None:
+                    df = fetch(name, args, kwargs)
+                    # Drop the private copy in favour of the mapped one.
+                    attached = _attach(name, ttl)
+                    if attached is not None:
+                        df = attached
+                        mark_cache_source("database")
+            return df
+
+        if use_shared:
+            return instrument_loader(_precomputed(load_shared))
+
+        memo_ttl = min(ttl, get_setting("DISK_CACHE_MEMO_TTL", 3600)) if disk_cache else ttl
+        memoized = st.experimental_memo(ttl=memo_ttl)(load)
+        return instrument_loader(_precomputed(memoized))
+
+    return decorator
+
+
+def derived(base):
+
+    # Declares a view computed from the frame returned by the loader base,
+    # e.g. one projection of a per-group summary. The view is memoized on
+    # the content of that frame, so it is rebuilt lazily once base has been
+    # refreshed and never outlives it. Each refresh of base adds an entry,
+    # so only the last few are kept (a base keyed on settings, e.g.
+    # AGGREGATION_BACKEND, has one current frame per combination).
+    def decorator(func):
+
+        view = st.experimental_memo(max_entries=get_setting("DERIVED_MAX_ENTRIES", 4))(func)
+
+        @functools.wraps(func)
+        def load() -> pd.DataFrame:
+            return view(base())
+
+        return instrument_loader(_precomputed(load))
+
+    return decorator
+
+
+def _to_param(value):
+
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def incremental_query(table, watermark_column, key_columns=None, full_refresh=False) -> pd.DataFrame:
+
+    # Keeps the last result of SELECT * FROM table on disk and only fetches
+    # rows at or past its high-water mark, replacing cached rows with the
+    # same key. Rows that fell out of the table's window (older than its
+    # first key) are dropped; a full reload happens on request, when the
+    # columns or row count no longer match the table, or every
+    # INCREMENTAL_FULL_REFRESH_TTL seconds. Without DISK_CACHE there is
+    # nowhere to keep the rows, so the table is read in full.
+    if not get_setting("INCREMENTAL_REFRESH", True) or not get_setting("DISK_CACHE", True):
+        return run_query("""
+        SELECT * FROM {}
+        """.format(table))
+
+    key_columns = key_columns or [watermark_column]
+    name = "incremental-{}".format(table)
+    full_refresh_ttl = get_setting("INCREMENTAL_FULL_REFRESH_TTL", 604800)
+
+    meta = read_meta(name)
+    df_cached = read_entry(name)
+    if (full_refresh or meta is None or df_cached is None or df_cached.empty
+            or time.time() - meta.get("full_refresh_at", 0) > full_refresh_ttl):
+        return _full_reload(name, table, full_refresh_ttl)
+
+    df_new = run_query("""
+    SELECT * FROM {table}
+    WHERE {watermark_column} >= :watermark
+    """.format(table=table, watermark_column=watermark_column),
+        params={"watermark": _to_param(df_cached[watermark_column].max())})
+
+    if list(df_new.columns) != list(df_cached.columns):
+        logger.info("columns of %s changed, reloading it in full", table)
+        return _full_reload(name, table, full_refresh_ttl)
+
+    df_stats = run_query("""
+    SELECT COUNT(*) AS total_rows, MIN({first_key}) AS first_key FROM {table}
+    """.format(table=table, first_key=key_columns[0]))
+    total_rows = int(df_stats.total_rows.iloc[0])
+    first_key = df_stats.first_key.iloc[0]
+
+    df_data = pd.concat([df_cached, df_new], ignore_index=True)
+    df_data = df_data.drop_duplicates(subset=key_columns, keep="last")
+    if first_key is not None:
+        if pd.api.types.is_datetime64_any_dtype(df_data[key_columns[0]]):
+            first_key = pd.Timestamp(first_key)
+        df_data = df_data[df_data[key_columns[0]] >= first_key]
+
+    if len(df_data) != total_rows:
+        logger.info("%s has %d rows but the merged cache has %d, reloading it in full",
+                    table, total_rows, len(df_data))
+        return _full_reload(name, table, full_refresh_ttl)
+
+    df_data = df_data.sort_values(key_columns).reset_index(drop=True)
+    write_entry(name, df_data, full_refresh_ttl, [table],
+                full_refresh_at=meta["full_refresh_at"])
+    return df_data
+
+
+def _full_reload(name, table, full_refresh_ttl):
+
+    df_data = run_query("""
+    SELECT * FROM {}
+    """.format(table))
+    write_entry(name, df_data, full_refresh_ttl, [table], full_refresh_at=time.time())
+    return df_data
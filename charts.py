@@ -0,0 +1,116 @@
+import functools
+import json
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from config import get_setting
+from instrumentation import mark_cache_source, measure
+
+DOWNSAMPLED_KINDS = ("area", "bar", "line", "scatter")
+
+
+def lttb_indices(x, y, threshold) -> np.ndarray:
+
+    # Largest-Triangle-Three-Buckets: keeps the first and last points and,
+    # from each of threshold - 2 equal buckets in between, the point forming
+    # the largest triangle with the previously kept point and the mean of
+    # the next bucket. x must be sorted ascending.
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.nanargmax(areas)) if np.isfinite(areas).any() else start
+        selected[i + 1] = previous
+
+    return selected
+
+
+def downsample(df, x, y, max_points, group=None) -> pd.DataFrame:
+
+    if len(df) <= max_points:
+        return df
+
+    parts = [df] if group is None else [part for _, part in df.groupby(group, sort=False)]
+    sampled = []
+    for part in parts:
+        if len(part) > max_points:
+            part = part.sort_values(x)
+            x_values = part[x]
+            if pd.api.types.is_datetime64_any_dtype(x_values):
+                x_values = x_values.astype("int64")
+            part = part.iloc[lttb_indices(x_values, part[y].fillna(0), max_points)]
+        sampled.append(part)
+
+    return pd.concat(sampled)
+
+
+@st.experimental_memo(max_entries=128)
+def figure_json(kind, df, layout=None, traces=None, **params) -> str:
+
+    # Memoized on the dataset contents and every chart parameter, so a rerun
+    # with unchanged data skips both figure construction and serialization.
+    mark_cache_source("build")
+    # plotly.express groups categoricals by every category, including
+    # unobserved ones and combinations, so hand it plain labels.
+    df = df.astype({column: object for column in df.select_dtypes("category").columns})
+
+    max_points = get_setting("CHART_MAX_POINTS_PER_TRACE", 2000)
+    x, y, color = params.get("x"), params.get("y"), params.get("color")
+    if kind in DOWNSAMPLED_KINDS and isinstance(x, str) and isinstance(y, str):
+        categorical_color = isinstance(color, str) and not pd.api.types.is_numeric_dtype(df[color])
+        df = downsample(df, x, y, max_points, group=color if categorical_color else None)
+
+    # Imported on the first figure build rather than at startup.
+    import plotly.express as px
+
+    fig = getattr(px, kind)(df, **params)
+    if traces:
+        fig.update_traces(**traces)
+    if layout:
+        fig.update_layout(**layout)
+
+    return fig.to_json()
+
+
+@functools.lru_cache(maxsize=128)
+def validated_figure(spec):
+
+    # st.plotly_chart validates a dict by rebuilding a Figure from it on
+    # every call, which costs about as much as building it with
+    # plotly.express; a Figure is only converted back to a dict. One Figure
+    # per spec is kept for the process and shared by every session, so it
+    # must not be modified.
+    import plotly.graph_objects as go
+
+    return go.Figure(json.loads(spec))
+
+
+def plotly_chart(kind, df, layout=None, traces=None, **params):
+
+    name = params.get("title") or kind
+    with measure("figure", name) as frame:
+        frame["cache"] = "memo"
+        frame["rows"] = len(df)
+        spec = figure_json(kind, df, layout, traces, **params)
+        frame["bytes"] = len(spec)
+
+    with measure("chart", name):
+        st.plotly_chart(validated_figure(spec), use_container_width=True)
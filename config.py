@@ -0,0 +1,54 @@
+import functools
+import os
+import threading
+
+import streamlit as st
+
+
+def _cast(value, default):
+    if default is None or not isinstance(value, str):
+        return value
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return type(default)(value)
+
+
+def get_setting(name, default=None):
+    # Environment variables win over .streamlit/secrets.toml so scripts and
+    # replicas can be configured without editing the secrets file.
+    if name in os.environ:
+        return _cast(os.environ[name], default)
+    try:
+        return _cast(st.secrets.get(name, default), default)
+    except FileNotFoundError:
+        return default
+
+
+def singleton(func):
+    # Caches one value per argument tuple for the life of the process, like
+    # st.experimental_singleton but also outside a Streamlit script run
+    # (benchmarks, jobs). Unlike functools.lru_cache, concurrent first calls
+    # build the value once: the other threads wait for it.
+    values = {}
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        try:
+            return values[args]
+        except KeyError:
+            pass
+        with lock:
+            if args not in values:
+                values[args] = func(*args)
+            return values[args]
+
+    def cache_clear():
+        # Returns the dropped values, e.g. engines to dispose of.
+        with lock:
+            dropped = list(values.values())
+            values.clear()
+        return dropped
+
+    wrapper.cache_clear = cache_clear
+    return wrapper
@@ -0,0 +1,375 @@
+import pandas as pd
+
+from cache import derived, incremental_query, loader
+from config import get_setting
+from db import grouped_stats_sql, run_aggregate_query, run_query, stream_query
+from sketches import build_sketch, merge_sketches, sketch_summary
+from transforms import compact_dtypes, concat_compact, gini_coefficients
+
+
+@loader(ttl=86400, tables=["ui_consensus_hosting_info"])
+def get_cl_hosting_diversity_data() -> pd.DataFrame:
+
+    sql = """
+    SELECT
+    consensus_client,
+    CASE
+        WHEN total_nodes <= 50 THEN 'Others'
+        ELSE hosting_provider_name
+    END AS hosting_provider_name,
+    hosting_provider_name AS asn,
+    SUM(total_nodes) AS total_nodes,
+    MIN(last_updated) As last_updated
+    FROM
+    ui_consensus_hosting_info
+    WHERE
+    hosting_provider_name IS NOT NULL
+    GROUP BY
+    consensus_client,
+    hosting_provider_name
+    """
+    return run_query(sql)
+
+
+@loader(ttl=86400, tables=["ui_client_info"])
+def get_client_info() -> pd.DataFrame:
+
+    sql = """
+    SELECT * 
+    FROM ui_client_info
+    """
+    return run_query(sql)
+
+
+@derived(get_client_info)
+def get_client_pairings(df_data) -> pd.DataFrame:
+
+    return df_data[(~df_data.execution_client.isna()) & (df_data.execution_client != '')]
+
+
+@derived(get_cl_hosting_diversity_data)
+def get_hosting_provider_affinity(df_data) -> pd.DataFrame:
+
+    return df_data[df_data.hosting_provider_name != 'Others']
+
+
+@loader(ttl=2592000, tables=["ui_validator_first_proposals"])
+def get_first_proposal_clients() -> pd.DataFrame:
+
+    return incremental_query("ui_validator_first_proposals", "last_updated",
+                             ["first_proposal_month", "predicted_client"])
+
+
+@loader(ttl=2592000, tables=["ui_proposals_by_client"])
+def get_proposals_by_client() -> pd.DataFrame:
+
+    sql_get_proposals_by_client = """
+    SELECT * FROM ui_proposals_by_client
+    """
+    return run_query(sql_get_proposals_by_client)
+
+
+@loader(ttl=2592000, tables=["ui_client_performance"], shared=True)
+def get_client_performance() -> pd.DataFrame:
+
+    sql_query = """
+    SELECT * FROM ui_client_performance
+    """
+    return concat_compact(compact_dtypes(chunk) for chunk in stream_query(sql_query))
+
+
+@loader(ttl=2592000, tables=["ui_depositor_performance"], shared=True)
+def get_depositor_performance() -> pd.DataFrame:
+
+    sql_query = """
+    SELECT * FROM ui_depositor_performance
+    """
+    return concat_compact(compact_dtypes(chunk) for chunk in stream_query(sql_query))
+
+
+@loader(ttl=2592000, tables=["ui_depositor_performance"])
+def get_depositor_performance_sketch(relative_accuracy) -> pd.DataFrame:
+
+    sql_query = """
+    SELECT depositor_label, apr FROM ui_depositor_performance
+    """
+    return merge_sketches(build_sketch(chunk, "depositor_label", "apr", relative_accuracy)
+                          for chunk in stream_query(sql_query))
+
+
+@loader(ttl=2592000, tables=["ui_depositor_performance"],
+        settings=["AGGREGATION_BACKEND", "SKETCH_RELATIVE_ACCURACY"])
+def get_depositor_performance_summary() -> pd.DataFrame:
+
+    def q25(x):
+        return x.quantile(0.25)
+
+    def q75(x):
+        return x.quantile(0.75)
+
+    def aggregate_in_pandas():
+        df_data = get_depositor_performance()
+        return df_data.groupby("depositor_label", observed=True).agg(
+            num_validators=pd.NamedAgg(column="apr", aggfunc="count"),
+            avg_apr=pd.NamedAgg(column="apr", aggfunc="mean"),
+            min_apr=pd.NamedAgg(column="apr", aggfunc="min"),
+            max_apr=pd.NamedAgg(column="apr", aggfunc="max"),
+            median_apr=pd.NamedAgg(column="apr", aggfunc="median"),
+            apr_25pct=pd.NamedAgg(column="apr", aggfunc=q25),
+            apr_75pct=pd.NamedAgg(column="apr", aggfunc=q75)
+        ).reset_index().sort_values("depositor_label", ignore_index=True)
+
+    aggregates = [
+        ("num_validators", "apr", "count"),
+        ("avg_apr", "apr", "mean"),
+        ("min_apr", "apr", "min"),
+        ("max_apr", "apr", "max"),
+        ("median_apr", "apr", 0.5),
+        ("apr_25pct", "apr", 0.25),
+        ("apr_75pct", "apr", 0.75),
+    ]
+    if get_setting("AGGREGATION_BACKEND", "sql") == "sketch":
+        accuracy = get_setting("SKETCH_RELATIVE_ACCURACY", 0.01)
+        return sketch_summary(get_depositor_performance_sketch(accuracy), "depositor_label", "apr", aggregates, accuracy)
+
+    sql_query = grouped_stats_sql("ui_depositor_performance", "depositor_label", "apr", aggregates)
+    return run_aggregate_query(sql_query, aggregate_in_pandas)
+
+
+@derived(get_depositor_performance_summary)
+def get_depositor_performance_apr(df_summary) -> pd.DataFrame:
+
+    df_grouped_data = df_summary[["depositor_label", "num_validators", "avg_apr"]]
+    return df_grouped_data.sort_values("avg_apr", ascending=False)
+
+
+@derived(get_depositor_performance_apr)
+def get_depositor_performance_table(df_data) -> pd.DataFrame:
+
+    return df_data.set_index('depositor_label').rename(columns={
+        'num_validators': 'Total Validators',
+        'avg_apr': 'Average APR',
+    })
+
+
+@derived(get_depositor_performance_summary)
+def get_depositor_performance_apr_quartiles(df_summary) -> pd.DataFrame:
+
+    df_grouped_data = df_summary[["depositor_label", "min_apr", "max_apr",
+                                  "median_apr", "apr_25pct", "apr_75pct"]]
+    df_grouped_data = df_grouped_data.set_index('depositor_label').stack().reset_index()
+    df_grouped_data.columns = ['Depositor', 'Name', 'APR']
+    # In percent, as plotted.
+    df_grouped_data['APR'] = df_grouped_data['APR'] * 100
+
+    return df_grouped_data
+
+
+@loader(ttl=2592000, tables=["ui_client_performance"])
+def get_client_performance_sketch(relative_accuracy) -> pd.DataFrame:
+
+    sql_query = """
+    SELECT client, apr FROM ui_client_performance
+    """
+    return merge_sketches(build_sketch(chunk, "client", "apr", relative_accuracy)
+                          for chunk in stream_query(sql_query))
+
+
+@loader(ttl=2592000, tables=["ui_client_performance"],
+        settings=["AGGREGATION_BACKEND", "SKETCH_RELATIVE_ACCURACY"])
+def get_client_performance_summary() -> pd.DataFrame:
+
+    def q25(x):
+        return x.quantile(0.25)
+
+    def q75(x):
+        return x.quantile(0.75)
+
+    def aggregate_in_pandas():
+        df_data = get_client_performance()
+        return df_data.groupby("client", observed=True).agg(
+            num_validators=pd.NamedAgg(column="validator", aggfunc="count"),
+            min_apr=pd.NamedAgg(column="apr", aggfunc="min"),
+            max_apr=pd.NamedAgg(column="apr", aggfunc="max"),
+            median_apr=pd.NamedAgg(column="apr", aggfunc="median"),
+            apr_25pct=pd.NamedAgg(column="apr", aggfunc=q25),
+            apr_75pct=pd.NamedAgg(column="apr", aggfunc=q75)
+        ).reset_index().sort_values("client", ignore_index=True)
+
+    aggregates = [
+        ("num_validators", "validator", "count"),
+        ("min_apr", "apr", "min"),
+        ("max_apr", "apr", "max"),
+        ("median_apr", "apr", 0.5),
+        ("apr_25pct", "apr", 0.25),
+        ("apr_75pct", "apr", 0.75),
+    ]
+    if get_setting("AGGREGATION_BACKEND", "sql") == "sketch":
+        accuracy = get_setting("SKETCH_RELATIVE_ACCURACY", 0.01)
+        return sketch_summary(get_client_performance_sketch(accuracy), "client", "apr", aggregates, accuracy)
+
+    sql_query = grouped_stats_sql("ui_client_performance", "client", "apr", aggregates)
+    return run_aggregate_query(sql_query, aggregate_in_pandas)
+
+
+@derived(get_client_performance_summary)
+def get_client_performance_apr(df_summary) -> pd.DataFrame:
+
+    df_grouped_data = df_summary[["client", "num_validators", "median_apr"]]
+    return df_grouped_data.sort_values("median_apr", ascending=False)
+
+
+@derived(get_client_performance_apr)
+def get_client_performance_table(df_data) -> pd.DataFrame:
+
+    return df_data.set_index('client').rename(columns={
+        'num_validators': 'Total Validators',
+        'median_apr': 'Median APR',
+    })
+
+
+@derived(get_client_performance_summary)
+def get_client_performance_apr_quartiles(df_summary) -> pd.DataFrame:
+
+    df_grouped_data = df_summary[["client", "min_apr", "max_apr",
+                                  "median_apr", "apr_25pct", "apr_75pct"]]
+    df_grouped_data = df_grouped_data.set_index('client').stack().reset_index()
+    df_grouped_data.columns = ['Client', 'Name', 'APR']
+    # In percent, as plotted.
+    df_grouped_data['APR'] = df_grouped_data['APR'] * 100
+
+    return df_grouped_data
+
+
+@loader(ttl=86400, tables=["ui_staking_client_distribution"])
+def get_staking_client_distribution() -> pd.DataFrame:
+
+    sql_ui_staking_client_distribution = """
+    SELECT * FROM ui_staking_client_distribution
+    """
+
+    return run_query(sql_ui_staking_client_distribution)
+
+
+@derived(get_staking_client_distribution)
+def get_staking_client_diversity(df_data) -> pd.DataFrame:
+
+    df_2 = df_data.pivot(index="staking_entity", columns="client",
+                         values="tot_validators")
+    # client may be categorical; plain column labels allow adding columns.
+    df_2.columns = df_2.columns.astype(str)
+    df_2 = df_2.reset_index().fillna(0)
+    df_2['Total Validators'] = df_2['Lighthouse'] + \
+        df_2['Lodestar'] + df_2['Nimbus'] + df_2['Prysm'] + df_2['Teku']
+
+    df_2.set_index('staking_entity', inplace=True)
+
+    subset_cols = ['Lighthouse', 'Prysm', 'Teku', 'Nimbus', 'Lodestar']
+
+    for col in subset_cols:
+        df_2[col] = df_2[col].astype(int)
+
+    df_2['Total Validators'] = df_2['Total Validators'].astype(int)
+
+    df_2['Diversity Coefficient'] = gini_coefficients(
+        df_2[subset_cols].to_numpy())
+
+    return df_2
+
+
+@derived(get_staking_client_diversity)
+def get_staking_client_diversity_table(df_data) -> pd.DataFrame:
+
+    cols = ['Diversity Coefficient', 'Lighthouse', 'Prysm',
+            'Teku', 'Nimbus', 'Lodestar', 'Total Validators']
+    return df_data[cols].sort_values('Diversity Coefficient')
+
+
+@loader(ttl=86400, tables=["ui_depositor_staking"])
+def get_depositor_staking() -> pd.DataFrame:
+
+    sql_ui_depositor_staking = """
+    SELECT * FROM ui_depositor_staking
+    """
+
+    return run_query(sql_ui_depositor_staking)
+
+
+@derived(get_depositor_staking)
+def get_depositor_staking_table(df_data) -> pd.DataFrame:
+
+    df_data = df_data.astype({'total_eth_deposited': int, 'eth_deposited_last_30days': int})
+    df_data = df_data[~df_data.depositor_type.isna()].set_index('depositor_label')
+
+    df_data['Change %'] = (
+        df_data['eth_deposited_last_30days']) / df_data['total_eth_deposited']
+
+    return df_data.rename(columns={
+        'depositor_type': 'Depositor Type',
+        'total_eth_deposited': 'Total ETH Deposited',
+        'eth_deposited_last_30days': 'Total ETH Deposited (Last 30 Days)',
+    })
+
+
+@derived(get_depositor_staking_table)
+def get_trending_depositors(df_data) -> pd.DataFrame:
+
+    cols = ['Depositor Type', 'Total ETH Deposited', 'Total ETH Deposited (Last 30 Days)']
+    return df_data[cols].sort_values('Total ETH Deposited (Last 30 Days)', ascending=False).head(5)
+
+
+@derived(get_depositor_staking_table)
+def get_growing_depositors(df_data) -> pd.DataFrame:
+
+    return df_data.sort_values('Change %', ascending=False).head(5)
+
+
+@loader(ttl=86400, tables=["ui_staking_overview"])
+def get_staking_overview() -> pd.DataFrame:
+
+    sql_query = """
+    SELECT * FROM ui_staking_overview
+    """
+
+    return run_query(sql_query)
+
+
+@loader(ttl=86400, tables=["dn_validators_signup_weekly"])
+def get_weekly_validator_signups() -> pd.DataFrame:
+
+    return incremental_query("dn_validators_signup_weekly", "first_deposit_week")
+
+
+@loader(ttl=86400, tables=["dn_depositors_signup_weekly"])
+def get_weekly_depositor_signups() -> pd.DataFrame:
+
+    return incremental_query("dn_depositors_signup_weekly", "week")
+
+
+@loader(ttl=86400, tables=["dn_block_stats_empty_missed"])
+def get_empty_block_stats() -> pd.DataFrame:
+
+    return incremental_query("dn_block_stats_empty_missed", "day")
+
+
+# Every dataset the dashboard renders, in its final shape.
+DASHBOARD_DATASETS = [
+    get_client_info,
+    get_client_pairings,
+    get_cl_hosting_diversity_data,
+    get_hosting_provider_affinity,
+    get_first_proposal_clients,
+    get_proposals_by_client,
+    get_client_performance_table,
+    get_client_performance_apr_quartiles,
+    get_staking_overview,
+    get_weekly_validator_signups,
+    get_weekly_depositor_signups,
+    get_depositor_staking,
+    get_trending_depositors,
+    get_growing_depositors,
+    get_depositor_performance_table,
+    get_depositor_performance_apr_quartiles,
+    get_staking_client_diversity_table,
+    get_empty_block_stats,
+]
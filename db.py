@@ -0,0 +1,328 @@
+import logging
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import deque, namedtuple
+
+import pandas as pd
+
+from config import get_setting, singleton
+
+logger = logging.getLogger(__name__)
+
+QueryTiming = namedtuple(
+    "QueryTiming", ["route", "sql", "acquire_seconds", "query_seconds", "rows", "finished_at"])
+
+# Each route has its own engine and pool. Both fall back to DB_CONN_URL, so
+# a single database needs no extra settings.
+ROUTES = {"replica": "DB_REPLICA_URL", "metadata": "DB_METADATA_URL"}
+
+# route -> consecutive failed queries, when the circuit opened, and whether
+# a trial query is running.
+_breakers = {route: {"failures": 0, "opened_at": None, "trial": False} for route in ROUTES}
+_breaker_lock = threading.Lock()
+
+
+class DatabaseUnavailable(Exception):
+
+    pass
+
+
+def route_for(sql):
+
+    # The heavy analytic tables in DB_REPLICA_TABLES are read from the
+    # replica, everything else from the metadata pool.
+    tables = get_setting(
+        "DB_REPLICA_TABLES", "ui_client_performance,ui_depositor_performance,dn_block_gas")
+    for table in tables.split(","):
+        if table.strip() and re.search(r"\b{}\b".format(re.escape(table.strip())), sql):
+            return "replica"
+    return "metadata"
+
+
+# config.singleton rather than st.experimental_singleton: Streamlit only
+# caches when a script run context exists, and the engine and buffers are
+# also used by the headless benchmark and job scripts.
+@singleton
+def get_engine(route="metadata"):
+
+    # SQLAlchemy is imported on first use: with published artifacts or a
+    # warm cache, a process may never need it.
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.pool import QueuePool
+
+    url = make_url(get_setting(ROUTES[route]) or get_setting("DB_CONN_URL"))
+    timeout = get_setting("DB_QUERY_TIMEOUT", 60)
+
+    if url.get_backend_name() == "sqlite":
+        # Local stand-in used by benchmarks/. FLOOR is only built into
+        # SQLite when it is compiled with math functions.
+        engine = create_engine(url, poolclass=QueuePool, connect_args={
+            "check_same_thread": False, "detect_types": sqlite3.PARSE_DECLTYPES})
+        event.listen(engine, "connect", lambda conn, _: conn.create_function(
+            "FLOOR", 1, math.floor, deterministic=True))
+
+        # SQLite has no statement timeout: a progress handler interrupts
+        # statements that run past it.
+        def set_deadline(conn, cursor, *_):
+            deadline = time.monotonic() + timeout
+            cursor.connection.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+
+        if timeout:
+            event.listen(engine, "before_cursor_execute", set_deadline)
+        return engine
+
+    connect_args = {"connect_timeout": get_setting("DB_CONNECT_TIMEOUT", 10)}
+    if timeout:
+        # The server aborts SELECTs after MAX_EXECUTION_TIME; the socket
+        # timeout, a little longer, covers a server that stops answering.
+        connect_args["read_timeout"] = timeout + 5
+
+    engine = create_engine(
+        url,
+        pool_size=get_setting("DB_POOL_SIZE", 5),
+        max_overflow=get_setting("DB_MAX_OVERFLOW", 10),
+        pool_timeout=get_setting("DB_POOL_TIMEOUT", 30),
+        pool_recycle=get_setting("DB_POOL_RECYCLE", 3600),
+        pool_pre_ping=get_setting("DB_POOL_PRE_PING", True),
+        connect_args=connect_args,
+    )
+    if timeout and url.get_backend_name() == "mysql":
+        def set_max_execution_time(conn, _):
+            with conn.cursor() as cursor:
+                cursor.execute("SET SESSION MAX_EXECUTION_TIME = {:d}".format(int(timeout * 1000)))
+
+        event.listen(engine, "connect", set_max_execution_time)
+    return engine
+
+
+def _allow(route):
+
+    # Closed: every query runs. Open: queries fail at once until
+    # DB_BREAKER_RESET seconds have passed, then a single trial query runs
+    # and closes the circuit again if it succeeds.
+    with _breaker_lock:
+        breaker = _breakers[route]
+        if breaker["opened_at"] is None:
+            return True
+        if breaker["trial"] or time.monotonic() - breaker["opened_at"] < get_setting("DB_BREAKER_RESET", 30):
+            return False
+        breaker["trial"] = True
+        return True
+
+
+def _record_outcome(route, ok):
+
+    with _breaker_lock:
+        breaker = _breakers[route]
+        breaker["trial"] = False
+        if ok:
+            breaker["failures"], breaker["opened_at"] = 0, None
+            return
+        breaker["failures"] += 1
+        if breaker["opened_at"] is not None or breaker["failures"] >= get_setting("DB_BREAKER_THRESHOLD", 5):
+            if breaker["opened_at"] is None:
+                logger.warning("circuit for the %s database opened after %d failed queries",
+                               route, breaker["failures"])
+            breaker["opened_at"] = time.monotonic()
+
+
+def _is_timeout(error):
+
+    # MySQL's ER_QUERY_TIMEOUT, or the SQLite progress handler.
+    args = getattr(getattr(error, "orig", None), "args", ())
+    return args[:1] == (3024,) or args[:1] == ("interrupted",)
+
+
+def is_schema_error(error):
+
+    # A missing table or column: MySQL's ER_NO_SUCH_TABLE and
+    # ER_BAD_FIELD_ERROR, or SQLite's equivalents, which it raises as
+    # OperationalError.
+    args = getattr(getattr(error, "orig", None), "args", ())
+    return args[:1] in ((1146,), (1054,)) or (
+        bool(args) and isinstance(args[0], str) and args[0].startswith(("no such table", "no such column")))
+
+
+def _is_unavailable(error):
+
+    # Errors that say the database can't serve queries right now, as
+    # opposed to errors in the query.
+    from sqlalchemy.exc import OperationalError, TimeoutError
+
+    return isinstance(error, TimeoutError) or (
+        isinstance(error, OperationalError) and not is_schema_error(error))
+
+
+def _call(route, operation):
+
+    # Runs operation, retrying connection errors with exponential backoff
+    # and jitter. Statements that hit DB_QUERY_TIMEOUT are not retried.
+    # Raises DatabaseUnavailable when the circuit is open or every attempt
+    # failed; other errors (e.g. bad SQL or a missing table) pass through
+    # and don't count against the circuit.
+    from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+    if not _allow(route):
+        raise DatabaseUnavailable("circuit for the {} database is open".format(route))
+
+    retrying = Retrying(
+        stop=stop_after_attempt(get_setting("DB_RETRY_ATTEMPTS", 3)),
+        wait=wait_random_exponential(multiplier=0.5, max=get_setting("DB_RETRY_MAX_WAIT", 10.0)),
+        retry=retry_if_exception(lambda error: _is_unavailable(error) and not _is_timeout(error)),
+        before_sleep=lambda state: logger.warning(
+            "%s query failed (attempt %d), retrying: %s",
+            route, state.attempt_number, state.outcome.exception()),
+        reraise=True)
+    try:
+        result = retrying(operation)
+    except BaseException as error:
+        if not _is_unavailable(error):
+            with _breaker_lock:
+                _breakers[route]["trial"] = False
+            raise
+        _record_outcome(route, False)
+        raise DatabaseUnavailable("{} query failed: {}".format(route, error)) from error
+    _record_outcome(route, True)
+    return result
+
+
+@singleton
+def get_query_timings() -> deque:
+
+    return deque(maxlen=get_setting("DB_QUERY_TIMINGS_SIZE", 500))
+
+
+def _record_timing(route, sql, started, acquired, rows):
+
+    timing = QueryTiming(route, " ".join(sql.split()), acquired - started,
+                         time.perf_counter() - acquired, rows, time.time())
+    get_query_timings().append(timing)
+    logger.debug("%s query acquire=%.3fs query=%.3fs rows=%d: %s", route,
+                 timing.acquire_seconds, timing.query_seconds, timing.rows, timing.sql)
+
+
+def run_query(sql, params=None, route=None) -> pd.DataFrame:
+
+    from sqlalchemy import text
+
+    route = route or route_for(sql)
+    engine = get_engine(route)
+
+    def attempt():
+        started = time.perf_counter()
+        with engine.connect() as conn:
+            acquired = time.perf_counter()
+            df = pd.read_sql(text(sql), conn, params=params)
+        _record_timing(route, sql, started, acquired, len(df))
+        return df
+
+    return _call(route, attempt)
+
+
+def stream_query(sql, params=None, chunksize=None, route=None):
+
+    # Yields the result in DataFrames of at most chunksize rows, read through
+    # an unbuffered server-side cursor (PyMySQL's SSCursor), so neither the
+    # driver nor pandas holds every row at once. The connection stays checked
+    # out until the generator is exhausted or closed, and the recorded query
+    # time includes the time spent consuming the chunks. Only opening the
+    # stream is retried; a failure after the first chunk raises
+    # DatabaseUnavailable.
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    route = route or route_for(sql)
+    engine = get_engine(route)
+    chunksize = chunksize or get_setting("DB_STREAM_CHUNKSIZE", 100000)
+
+    def attempt():
+        started = time.perf_counter()
+        conn = engine.connect()
+        acquired = time.perf_counter()
+        try:
+            # pandas executes the query before returning the iterator.
+            chunks = pd.read_sql(text(sql), conn.execution_options(stream_results=True),
+                                 params=params, chunksize=chunksize)
+        except BaseException:
+            conn.close()
+            raise
+        return conn, chunks, started, acquired
+
+    rows = 0
+    conn, chunks, started, acquired = _call(route, attempt)
+    with conn:
+        try:
+            for chunk in chunks:
+                rows += len(chunk)
+                yield chunk
+        except OperationalError as error:
+            if not _is_unavailable(error):
+                raise
+            _record_outcome(route, False)
+            raise DatabaseUnavailable("{} query failed: {}".format(route, error)) from error
+
+    _record_timing(route, sql, started, acquired, rows)
+
+
+def grouped_stats_sql(table, group_column, value_column, aggregates):
+
+    # Builds a single query returning one row per group. aggregates is a list
+    # of (alias, column, aggfunc) tuples mirroring pd.NamedAgg, where aggfunc
+    # is "count", "mean", "min", "max" or a quantile between 0 and 1 of
+    # value_column. Quantiles use the same linear interpolation as
+    # pandas.Series.quantile; NULL values sort last and are not ranked.
+    select = ["grp AS {}".format(group_column)]
+    for alias, column, aggfunc in aggregates:
+        if aggfunc == "count":
+            expr = "COUNT({})".format(column)
+        elif aggfunc == "mean":
+            expr = "AVG({})".format(column)
+        elif aggfunc in ("min", "max"):
+            expr = "{}({})".format(aggfunc.upper(), column)
+        else:
+            pos = "(n - 1) * {!r}".format(float(aggfunc))
+            expr = """SUM(CASE
+        WHEN rn = FLOOR({pos}) THEN {col} * (1 - ({pos} - FLOOR({pos})))
+        WHEN rn = FLOOR({pos}) + 1 THEN {col} * ({pos} - FLOOR({pos}))
+        ELSE NULL END)""".format(pos=pos, col=column)
+        select.append("{} AS {}".format(expr, alias))
+
+    return """
+    WITH ranked AS (
+        SELECT
+        {group_column} AS grp,
+        {columns},
+        ROW_NUMBER() OVER (
+            PARTITION BY {group_column}
+            ORDER BY {value_column} IS NULL, {value_column}) - 1 AS rn,
+        COUNT({value_column}) OVER (PARTITION BY {group_column}) AS n
+        FROM {table}
+    )
+    SELECT
+    {select}
+    FROM ranked
+    GROUP BY grp
+    ORDER BY grp
+    """.format(group_column=group_column, value_column=value_column, table=table,
+               columns=", ".join(dict.fromkeys(
+                   [value_column] + [column for _, column, _ in aggregates])),
+               select=",\n    ".join(select))
+
+
+def run_aggregate_query(sql, pandas_fallback) -> pd.DataFrame:
+
+    from sqlalchemy.exc import DBAPIError
+
+    if get_setting("AGGREGATION_BACKEND", "sql") == "sql":
+        try:
+            return run_query(sql)
+        except DBAPIError:
+            # e.g. MySQL < 8.0 has no window functions.
+            logger.warning(
+                "aggregate query failed, falling back to pandas", exc_info=True)
+
+    return pandas_fallback()
@@ -0,0 +1,210 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+import pandas as pd
+import streamlit as st
+
+from config import get_setting, singleton
+from db import get_query_timings
+
+_local = threading.local()
+_log_lock = threading.Lock()
+# Open measurements tracing memory, in every thread.
+_tracing = []
+_tracing_lock = threading.Lock()
+
+
+@singleton
+def get_timings() -> deque:
+
+    return deque(maxlen=get_setting("INSTRUMENTATION_SIZE", 2000))
+
+
+def _stack():
+
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def mark_cache_source(source):
+
+    # Called from inside a memoized function body, i.e. on a memo miss, to
+    # tell the enclosing measure() where the result came from.
+    if _stack():
+        _stack()[-1]["cache"] = source
+
+
+def _size(result):
+
+    if isinstance(result, pd.DataFrame):
+        return len(result), int(result.memory_usage(index=True).sum())
+    if isinstance(result, (str, bytes)):
+        return None, len(result)
+    return None, None
+
+
+@contextlib.contextmanager
+def measure(kind, name):
+
+    if not get_setting("INSTRUMENTATION", True):
+        yield {}
+        return
+
+    frame = {"kind": kind, "name": name, "cache": None, "rows": None, "bytes": None}
+    trace_memory = get_setting("INSTRUMENTATION_TRACE_MEMORY", False)
+    if trace_memory:
+        # Resetting the peak would lose it for the measurements already
+        # open, e.g. the loader around a nested one, so it is folded into
+        # theirs first. While open, peak_bytes holds the absolute peak.
+        with _tracing_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            peak = tracemalloc.get_traced_memory()[1]
+            for other in _tracing:
+                other["peak_bytes"] = max(other["peak_bytes"], peak)
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+            frame["peak_bytes"] = memory_before
+            _tracing.append(frame)
+
+    _stack().append(frame)
+    started = time.perf_counter()
+    try:
+        yield frame
+    finally:
+        frame["wall_seconds"] = time.perf_counter() - started
+        _stack().pop()
+        # The peak is process-wide, so concurrent work (e.g. prefetch
+        # threads) is attributed to every measurement that overlaps it.
+        if trace_memory:
+            with _tracing_lock:
+                _tracing[:] = [other for other in _tracing if other is not frame]
+                frame["peak_bytes"] = max(frame["peak_bytes"], tracemalloc.get_traced_memory()[1]) - memory_before
+        else:
+            frame["peak_bytes"] = None
+        frame["finished_at"] = time.time()
+        _record(frame)
+
+
+def _record(frame):
+
+    get_timings().append(frame)
+
+    log_path = get_setting("INSTRUMENTATION_LOG")
+    if log_path:
+        with _log_lock, open(log_path, "a") as f:
+            f.write(json.dumps(frame) + "\n")
+
+
+def instrument_loader(func):
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        with measure("loader", func.__name__) as frame:
+            frame["cache"] = "memo"
+            result = func(*args, **kwargs)
+            frame["rows"], frame["bytes"] = _size(result)
+        return result
+
+    return timed
+
+
+def dataframe(name, data, **kwargs):
+
+    with measure("table", name) as frame:
+        frame["rows"] = len(data.data if isinstance(data, pd.io.formats.style.Styler) else data)
+        return st.dataframe(data, **kwargs)
+
+
+def _labels(**labels):
+
+    return ",".join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels.items())
+
+
+def prometheus_text() -> str:
+
+    lines = [
+        "# HELP ethdash_duration_seconds Wall time of instrumented loaders, figures and tables.",
+        "# TYPE ethdash_duration_seconds summary",
+    ]
+    df = pd.DataFrame(list(get_timings()))
+    if df.empty:
+        return "\n".join(lines) + "\n"
+
+    for (kind, name), group in df.groupby(["kind", "name"]):
+        labels = _labels(kind=kind, name=name)
+        lines.append("ethdash_duration_seconds_count{{{}}} {}".format(labels, len(group)))
+        lines.append("ethdash_duration_seconds_sum{{{}}} {:.6f}".format(labels, group.wall_seconds.sum()))
+
+    lines += [
+        "# HELP ethdash_cache_results_total Instrumented calls by where the result came from.",
+        "# TYPE ethdash_cache_results_total counter",
+    ]
+    for (kind, name, cache), group in df.dropna(subset=["cache"]).groupby(["kind", "name", "cache"]):
+        lines.append("ethdash_cache_results_total{{{}}} {}".format(
+            _labels(kind=kind, name=name, cache=cache), len(group)))
+
+    for metric, column, help_text in [
+        ("ethdash_rows", "rows", "Rows in the last result."),
+        ("ethdash_bytes", "bytes", "Size in bytes of the last result."),
+        ("ethdash_peak_bytes", "peak_bytes", "Peak traced memory during the last call."),
+    ]:
+        lines += ["# HELP {} {}".format(metric, help_text), "# TYPE {} gauge".format(metric)]
+        for (kind, name), group in df.dropna(subset=[column]).groupby(["kind", "name"]):
+            lines.append("{}{{{}}} {}".format(metric, _labels(kind=kind, name=name), int(group[column].iloc[-1])))
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics():
+
+    # Meant for the node_exporter textfile collector.
+    path = get_setting("INSTRUMENTATION_PROM_FILE")
+    if path:
+        with open(path + ".tmp", "w") as f:
+            f.write(prometheus_text())
+        os.replace(path + ".tmp", path)
+
+
+def render_diagnostics():
+
+    df = pd.DataFrame(list(get_timings()))
+    if df.empty:
+        st.text("No measurements yet.")
+        return
+
+    st.text("Wall time by loader, figure and table (seconds)")
+    summary = df.groupby(["kind", "name"]).agg(
+        calls=pd.NamedAgg(column="wall_seconds", aggfunc="count"),
+        p50=pd.NamedAgg(column="wall_seconds", aggfunc="median"),
+        p95=pd.NamedAgg(column="wall_seconds", aggfunc=lambda x: x.quantile(0.95)),
+        max=pd.NamedAgg(column="wall_seconds", aggfunc="max"),
+        rows=pd.NamedAgg(column="rows", aggfunc="last"),
+        bytes=pd.NamedAgg(column="bytes", aggfunc="last"),
+        peak_bytes=pd.NamedAgg(column="peak_bytes", aggfunc="max"),
+    ).sort_values("p95", ascending=False)
+    st.dataframe(summary, use_container_width=True)
+
+    st.text("Cache results")
+    st.dataframe(df.dropna(subset=["cache"]).groupby(["kind", "name", "cache"]).size().unstack(fill_value=0),
+                 use_container_width=True)
+
+    datasets = df[df.kind == "dataset"]
+    if not datasets.empty:
+        st.text("Dataset memory after dtype compaction (bytes)")
+        memory = datasets.groupby("name").last()[["rows", "bytes_before", "bytes"]]
+        memory["ratio"] = memory["bytes"] / memory["bytes_before"]
+        st.dataframe(memory.sort_values("bytes_before", ascending=False), use_container_width=True)
+
+    st.text("Recent queries (seconds)")
+    st.dataframe(pd.DataFrame(list(get_query_timings())).iloc[::-1], use_container_width=True)
+
+    st.text("Prometheus metrics")
+    st.code(prometheus_text(), language="text")
@@ -0,0 +1,90 @@
+"""Materialize every dataset the dashboard renders into versioned artifacts.
+
+Meant to run from cron, e.g. hourly:
+
+    python precompute.py
+
+Each run writes the datasets as Arrow IPC files to a new version directory
+under ARTIFACTS_DIR and then points ARTIFACTS_DIR/CURRENT at it, so the app
+switches to a complete set at once. The app serves the current version
+instead of querying and reshaping data, and falls back to loading a dataset
+itself when it is missing from the version or the version is older than
+ARTIFACTS_MAX_AGE.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+# The job computes the artifacts, so it must not read them, and it should
+# publish current data rather than serve stale cache entries. A dataset the
+# database can't deliver fails instead of being published from the cache.
+os.environ["PRECOMPUTED"] = "false"
+os.environ.setdefault("STALE_WHILE_REVALIDATE", "false")
+os.environ["CACHE_FALLBACK"] = "false"
+
+import datasets  # noqa: E402
+from cache import write_table  # noqa: E402
+from config import get_setting  # noqa: E402
+
+logger = logging.getLogger("precompute")
+
+
+def publish(loaders, directory, keep):
+
+    version = "{}-{}".format(time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()), os.getpid())
+    path = os.path.join(directory, version)
+    os.makedirs(path)
+
+    manifest = {"version": version, "created_at": time.time(), "datasets": {}, "failed": []}
+    for load in loaders:
+        name = load.__name__
+        started = time.perf_counter()
+        try:
+            df = load()
+            write_table(os.path.join(path, name + ".arrow"), df)
+        except Exception:
+            logger.exception("could not materialize %s", name)
+            manifest["failed"].append(name)
+            continue
+        manifest["datasets"][name] = {"rows": len(df), "seconds": round(time.perf_counter() - started, 3)}
+        logger.info("%s: %d rows in %.2fs", name, len(df), time.perf_counter() - started)
+
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    current = os.path.join(directory, "CURRENT")
+    with open(current + ".tmp", "w") as f:
+        f.write(version)
+    os.replace(current + ".tmp", current)
+
+    # Versions sort by creation time. Processes still reading an older one
+    # keep their memory-mapped files after they are removed.
+    versions = sorted(entry.name for entry in os.scandir(directory) if entry.is_dir())
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", default=get_setting("ARTIFACTS_DIR", ".cache/artifacts"),
+                        help="artifact directory (default: ARTIFACTS_DIR)")
+    parser.add_argument("--keep", type=int, default=3, help="number of versions to keep")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    os.makedirs(args.dir, exist_ok=True)
+    manifest = publish(datasets.DASHBOARD_DATASETS, args.dir, max(args.keep, 1))
+    logger.info("published %s with %d datasets", manifest["version"], len(manifest["datasets"]))
+
+    return 1 if manifest["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+# Bucket signs. Values closer to zero than MIN_VALUE share one bucket, and
+# missing values are only counted.
+NEGATIVE, ZERO, POSITIVE, MISSING = -1, 0, 1, 2
+MIN_VALUE = 1e-9
+
+
+def _gamma(relative_accuracy):
+
+    return (1 + relative_accuracy) / (1 - relative_accuracy)
+
+
+def build_sketch(df, group_column, value_column, relative_accuracy) -> pd.DataFrame:
+
+    # Per-group quantile sketch of value_column with relative error
+    # (DDSketch): a value x is counted in bucket k = ceil(log_gamma |x|),
+    # i.e. (gamma**(k-1), gamma**k], with gamma = (1 + a) / (1 - a), so any
+    # quantile read from the buckets is within a factor 1 +- a of the exact
+    # one. The size depends on the spread of the values, not their number.
+    # One row per group and bucket with the count and sum of its values.
+    values = df[value_column].to_numpy(dtype=float)
+    magnitude = np.abs(values)
+
+    sign = np.where(magnitude < MIN_VALUE, ZERO, np.sign(values))
+    sign = np.where(np.isnan(values), MISSING, sign).astype(np.int8)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        key = np.ceil(np.log(magnitude) / np.log(_gamma(relative_accuracy)))
+    key = np.where(np.abs(sign) == 1, key, 0).astype(np.int32)
+
+    df_sketch = pd.DataFrame({group_column: df[group_column].array, "sign": sign, "key": key,
+                              "count": 1, "total": np.nan_to_num(values)})
+    return df_sketch.groupby([group_column, "sign", "key"], observed=True, sort=False)[
+        ["count", "total"]].sum().reset_index()
+
+
+def merge_sketches(sketches) -> pd.DataFrame:
+
+    # Sketches of the same column and accuracy merge by adding up buckets.
+    # They are folded one at a time, so merging the sketches of streamed
+    # chunks holds the merged sketch and one chunk's sketch.
+    merged = None
+    for df_sketch in sketches:
+        if merged is not None:
+            df_sketch = pd.concat([merged, df_sketch], ignore_index=True)
+            group_column = df_sketch.columns[0]
+            df_sketch = df_sketch.groupby([group_column, "sign", "key"], observed=True, sort=False)[
+                ["count", "total"]].sum().reset_index()
+        merged = df_sketch
+    return merged
+
+
+def sketch_summary(df_sketch, group_column, value_column, aggregates, relative_accuracy) -> pd.DataFrame:
+
+    # Reads the aggregates of db.grouped_stats_sql from a sketch, one row
+    # per group. "count" of value_column counts values that are not missing,
+    # "count" of any other column counts every row; "mean" is exact. "min",
+    # "max" and quantiles are bucket midpoints within the relative accuracy
+    # of the value at rank floor(q * (n - 1)); pandas would interpolate
+    # between it and the next value.
+    gamma = _gamma(relative_accuracy)
+    df_sketch = df_sketch.assign(value=np.where(
+        np.abs(df_sketch.sign) == 1,
+        df_sketch.sign * 2 * np.power(gamma, df_sketch.key.astype(float)) / (gamma + 1), 0.0))
+
+    df_values = df_sketch[df_sketch.sign != MISSING].sort_values([group_column, "value"])
+    grouped = df_values.groupby(group_column, observed=True, sort=False)
+    n = grouped["count"].transform("sum")
+    df_values = df_values.assign(rank=grouped["count"].cumsum() - 1, n=n)
+
+    df_summary = pd.DataFrame(index=df_sketch.groupby(group_column, observed=True).size().index)
+    for alias, column, aggfunc in aggregates:
+        if aggfunc == "count":
+            frame = df_values if column == value_column else df_sketch
+            df_summary[alias] = frame.groupby(group_column, observed=True)["count"].sum()
+        elif aggfunc == "mean":
+            df_summary[alias] = grouped["total"].sum() / grouped["count"].sum()
+        elif aggfunc == "min":
+            df_summary[alias] = grouped["value"].first()
+        elif aggfunc == "max":
+            df_summary[alias] = grouped["value"].last()
+        else:
+            # The bucket holding the value at rank q * (n - 1), counting from 0.
+            in_bucket = df_values["rank"] >= np.floor(float(aggfunc) * (df_values.n - 1))
+            df_summary[alias] = df_values[in_bucket].groupby(group_column, observed=True)["value"].first()
+
+    # Groups come in order of appearance; sort them like the SQL and pandas
+    # backends.
+    return df_summary.reset_index().sort_values(group_column, ignore_index=True)
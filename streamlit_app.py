@@ -1,11 +1,37 @@
-import time  # to simulate a real time data, time loop
-
-import numpy as np  # np mean, np random
-import pandas as pd  # read csv, df manipulation
-import plotly.express as px  # interactive charts
 import streamlit as st  # 🎈 data web app development
-import pymysql
-from sqlalchemy import create_engine
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+import pandas as pd
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from blocks import fee_series, get_block_store, time_range
+from charts import plotly_chart
+from config import get_setting
+from datasets import (
+    get_cl_hosting_diversity_data,
+    get_client_info,
+    get_client_pairings,
+    get_client_performance_apr_quartiles,
+    get_client_performance_table,
+    get_depositor_performance_apr_quartiles,
+    get_depositor_performance_table,
+    get_depositor_staking,
+    get_empty_block_stats,
+    get_first_proposal_clients,
+    get_growing_depositors,
+    get_hosting_provider_affinity,
+    get_proposals_by_client,
+    get_staking_client_diversity_table,
+    get_staking_overview,
+    get_trending_depositors,
+    get_weekly_depositor_signups,
+    get_weekly_validator_signups,
+)
+from instrumentation import dataframe, render_diagnostics, write_metrics
+from tables import paginated_table
 
 
 st.set_page_config(
@@ -33,536 +59,355 @@ hide_streamlit_style = """
 
 st.markdown(hide_streamlit_style, unsafe_allow_html=True)
 
-DB_CONN_URL = st.secrets["DB_CONN_URL"]
-
-
-@st.experimental_memo(ttl=86400)
-def get_cl_hosting_diversity_data() -> pd.DataFrame:
-
-    sql = """
-    SELECT
-    consensus_client,
-    CASE
-        WHEN total_nodes <= 50 THEN 'Others'
-        ELSE hosting_provider_name
-    END AS hosting_provider_name,
-    hosting_provider_name AS asn,
-    SUM(total_nodes) AS total_nodes,
-    MIN(last_updated) As last_updated
-    FROM
-    ui_consensus_hosting_info
-    WHERE
-    hosting_provider_name IS NOT NULL
-    GROUP BY
-    consensus_client,
-    hosting_provider_name
-    """
-    return run_query(sql)
-
-
-def run_query(sql):
-
-    engine = create_engine(DB_CONN_URL, pool_recycle=3600)
-    df = pd.read_sql(sql, engine)
-    return df
-
-
-@st.experimental_memo(ttl=86400)
-def get_client_info() -> pd.DataFrame:
-
-    sql = """
-    SELECT * 
-    FROM ui_client_info
-    """
-    return run_query(sql)
-
-
-@st.experimental_memo(ttl=2592000)
-def get_first_proposal_clients() -> pd.DataFrame:
-
-    sql_get_first_proposals = """
-    SELECT * FROM ui_validator_first_proposals
-    """
-    return run_query(sql_get_first_proposals)
-
-
-@st.experimental_memo(ttl=2592000)
-def get_proposals_by_client() -> pd.DataFrame:
-
-    sql_get_proposals_by_client = """
-    SELECT * FROM ui_proposals_by_client
-    """
-    return run_query(sql_get_proposals_by_client)
-
-
-@st.experimental_memo(ttl=2592000)
-def get_client_performance() -> pd.DataFrame:
-
-    sql_query = """
-    SELECT * FROM ui_client_performance
-    """
-    engine = create_engine(DB_CONN_URL, pool_recycle=3600)
-    df_data = pd.read_sql(sql_query, engine)
-    return df_data
-
-
-@st.experimental_memo(ttl=2592000)
-def get_depositor_performance() -> pd.DataFrame:
-
-    sql_query = """
-    SELECT * FROM ui_depositor_performance
-    """
-    return run_query(sql_query)
-
-
-@st.experimental_memo(ttl=2592000)
-def get_depositor_performance_apr() -> pd.DataFrame:
 
-    df_data = get_depositor_performance()
-    df_grouped_data = df_data.groupby(['depositor_label']).agg(
-        num_validators=pd.NamedAgg(column="apr", aggfunc="count"),
-        avg_apr=pd.NamedAgg(column="apr", aggfunc="mean")
-    ).reset_index().sort_values("avg_apr", ascending=False)
+def prefetch(loaders):
 
-    return df_grouped_data
+    ctx = get_script_run_ctx()
 
+    def run_loader(loader):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return loader()
 
-@st.experimental_memo(ttl=2592000)
-def get_depositor_performance_apr_quartiles() -> pd.DataFrame:
+    max_workers = min(get_setting("PREFETCH_WORKERS", 8), len(loaders))
+    if max_workers < 1:
+        return
 
-    df_data = get_depositor_performance()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch") as executor:
+        futures = {executor.submit(run_loader, loader): loader for loader in loaders}
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                # The tab that needs the dataset calls the loader again and
+                # surfaces the error there.
+                logging.getLogger(__name__).warning(
+                    "prefetch of %s failed", futures[future].__name__, exc_info=future.exception())
 
-    def q25(x):
-        return x.quantile(0.25)
 
-    def q75(x):
-        return x.quantile(0.75)
+def set_fig_caption(text):
+    st.markdown("<p style='text-align: center; font-size:12px;'>{}</p>".format(text),
+                unsafe_allow_html=True)
 
-    df_grouped_data = df_data.groupby("depositor_label").agg(
-        min_apr=pd.NamedAgg(column="apr", aggfunc="min"),
-        max_apr=pd.NamedAgg(column="apr", aggfunc="max"),
-        median_apr=pd.NamedAgg(column="apr", aggfunc="median"),
-        apr_25pct=pd.NamedAgg(column="apr", aggfunc=q25),
-        apr_75pct=pd.NamedAgg(column="apr", aggfunc=q75)
-    ).reset_index()
 
-    df_grouped_data = df_grouped_data.set_index(
-        'depositor_label').stack().reset_index()
-    df_grouped_data.columns = ['Depositor', 'Name', 'APR']
+client_color = {
+    'Lighthouse': '#00dbeb',
+    'Lodestar': '#ffa71a',
+    'Nimbus': '#f5009b',
+    'Prysm': '#a323d1',
+    'Teku': '#4e00de'
+}
 
-    return df_grouped_data
 
+def render_client_pairings():
 
-@st.experimental_memo(ttl=2592000)
-def get_client_performance_apr() -> pd.DataFrame:
+    df = get_client_info()
 
-    df_data = get_client_performance()
-    df_grouped_data = df_data.groupby(['client']).agg(
-        num_validators=pd.NamedAgg(column="validator", aggfunc="count"),
-        median_apr=pd.NamedAgg(column="apr", aggfunc="median")
-    ).reset_index().sort_values("median_apr", ascending=False)
+    st.metric("Consensus Nodes Discovered", df.total_nodes.sum(),
+              help="crawler running since 26-Oct-22")
 
-    return df_grouped_data
+    plotly_chart("pie", df, values='total_nodes', names='consensus_client',
+                 title='Consensus Client Distribution')
 
+    last_updated = df.last_updated.min()
+    fig_caption = "Data Source : <a href='https://www.twigblock.com/projects/eth-merge-challenge/t/emg-ca-data-collect'>CL crawler</a> ; Last Updated : {} ; Update Frequency: Daily</h1>".format(
+        last_updated.date())
+    set_fig_caption(fig_caption)
 
-@st.experimental_memo(ttl=2592000)
-def get_client_performance_apr_quartiles() -> pd.DataFrame:
+    df_pairings = get_client_pairings()
+    plotly_chart("treemap", df_pairings, path=[
+                 'execution_client', 'consensus_client'], values='total_nodes', title='EL-CL Client Pairings')
 
-    df_client_performance = get_client_performance()
+    st.markdown("<p style='text-align: center; font-size:12px;'> IP matches for {} nodes</p>".format(
+        df_pairings.total_nodes.sum()), unsafe_allow_html=True)
 
-    def q25(x):
-        return x.quantile(0.25)
+    st.markdown("<p style='text-align: center; font-size:12px;'> \
+        Data Source : <a href='https://www.twigblock.com/projects/eth-merge-challenge/t/emg-ca-data-collect'>EL & CL crawler</a> ; Last Updated : {} ; Update Frequency: Daily</p>".format(last_updated.date()), unsafe_allow_html=True)
 
-    def q75(x):
-        return x.quantile(0.75)
 
-    df_grouped_data = df_client_performance.groupby("client").agg(
-        min_apr=pd.NamedAgg(column="apr", aggfunc="min"),
-        max_apr=pd.NamedAgg(column="apr", aggfunc="max"),
-        median_apr=pd.NamedAgg(column="apr", aggfunc="median"),
-        apr_25pct=pd.NamedAgg(column="apr", aggfunc=q25),
-        apr_75pct=pd.NamedAgg(column="apr", aggfunc=q75)
-    ).reset_index()
+def render_hosting_diversity():
 
-    df_grouped_data = df_grouped_data.set_index('client').stack().reset_index()
-    df_grouped_data.columns = ['Client', 'Name', 'APR']
+    df = get_cl_hosting_diversity_data()
+    last_updated = df.last_updated.min()
 
-    return df_grouped_data
+    st.metric("Unique ASNs Found", len(df.asn.unique()),
+              help="includes ISPs, broadbands etc")
 
+    plotly_chart("pie", df, values='total_nodes', names='hosting_provider_name', title='Consensus Hosting Diversity',
+                 traces=dict(textposition='inside'),
+                 layout=dict(uniformtext_minsize=12, uniformtext_mode='hide'))
 
-@st.experimental_memo(ttl=86400)
-def get_staking_client_distribution() -> pd.DataFrame:
+    fig_caption = "Data Source : <a href='https://www.twigblock.com/projects/eth-merge-challenge/t/emg-ca-data-collect'>CL crawler</a> ; Last Updated : {} ; Update Frequency: Daily</h1>".format(
+        last_updated.date())
+    set_fig_caption(fig_caption)
 
-    sql_ui_staking_client_distribution = """
-    SELECT * FROM ui_staking_client_distribution
-    """
+    plotly_chart("treemap", get_hosting_provider_affinity(), path=[
+                 'hosting_provider_name', 'consensus_client'], values='total_nodes', title='Consensus Client - Hosting Provider : Affinity')
 
-    engine = create_engine(DB_CONN_URL, pool_recycle=3600)
-    df_data = pd.read_sql(sql_ui_staking_client_distribution, engine)
-    return df_data
+    fig_caption = "Data Source : <a href='https://www.twigblock.com/projects/eth-merge-challenge/t/emg-ca-data-collect'>CL crawler</a> ; Last Updated : {} ; Update Frequency: Daily</h1>".format(
+        last_updated.date())
+    set_fig_caption(fig_caption)
 
 
-@st.experimental_memo(ttl=86400)
-def get_depositor_staking() -> pd.DataFrame:
+def render_trending_clients():
 
-    sql_ui_depositor_staking = """
-    SELECT * FROM ui_depositor_staking
-    """
+    df = get_first_proposal_clients()
+    plotly_chart("line", df, x='first_proposal_month', y='total_validators', color='predicted_client',
+                 markers=True, color_discrete_map=client_color, title="Client Breakdown (by validator's first proposal)",
+                 layout=dict(xaxis=dict(showgrid=False), yaxis=dict(showgrid=False),
+                             xaxis_title="Month", yaxis_title="New Validators", legend_title="Client"))
 
-    engine = create_engine(DB_CONN_URL, pool_recycle=3600)
-    df_data = pd.read_sql(sql_ui_depositor_staking, engine)
-    return df_data
+    last_updated = df.last_updated.min()
+    fig_caption = "Data Source : <a href='https://www.twigblock.com/projects/eth-merge-challenge/t/emg-sa-data-collect'>Client prediction by Blockprint</a> ; Last Updated : {} ; Update Frequency: Monthly</h1>".format(
+        last_updated.date())
+    set_fig_caption(fig_caption)
 
+    df_2 = get_proposals_by_client()
+    plotly_chart("area", df_2, x="proposal_month", y="total_proposals", color="predicted_client",
+                 color_discrete_map=client_color, pattern_shape="predicted_client", pattern_shape_sequence=[".", "x", "+", "-", '|'],
+                 title="Client Breakdown (by block proposals)",
+                 layout=dict(xaxis=dict(showgrid=False), yaxis=dict(showgrid=False),
+                             xaxis_title="Month", yaxis_title="Total Proposals", legend_title="Client"))
 
-@st.experimental_memo(ttl=86400)
-def get_staking_overview() -> pd.DataFrame:
+    fig_caption = "Data Source : <a href='https://www.twigblock.com/projects/eth-merge-challenge/t/emg-sa-data-collect'>Client prediction by Blockprint</a> ; Last Updated : {} ; Update Frequency: Monthly</h1>".format(
+        last_updated.date())
+    set_fig_caption(fig_caption)
 
-    sql_query = """
-    SELECT * FROM ui_staking_overview
-    """
 
-    return run_query(sql_query)
+def render_client_effectiveness():
 
+    col1, col2, col3 = st.columns(3)
+    with col2:
+        df_client_performance_apr = get_client_performance_table()
+        st.text("Client Performance (Last 31 days)")
+        dataframe("Client Performance", df_client_performance_apr.style.text_gradient(
+            subset='Median APR', cmap="Greens", vmin=-5, vmax=5).format({'Median APR': "{:.2%}"}))
 
-@st.experimental_memo(ttl=86400)
-def get_weekly_validator_signups() -> pd.DataFrame:
+    st.text("Client Performance (Last 31 days) Distribution")
+    df_grouped_data = get_client_performance_apr_quartiles()
+    plotly_chart("box", df_grouped_data, x="Client", y="APR",
+                 color="Client", color_discrete_map=client_color,
+                 layout=dict(xaxis=dict(showgrid=False), yaxis=dict(showgrid=False), yaxis_title="APR %"))
 
-    sql_query = """
-    SELECT * FROM dn_validators_signup_weekly
-    """
 
-    return run_query(sql_query)
+def render_staking_overview():
 
+    df_staking_overview = get_staking_overview()
 
-@st.experimental_memo(ttl=86400)
-def get_weekly_depositor_signups() -> pd.DataFrame:
+    depositor_change = str(
+        round(df_staking_overview.depositor_change*100, 1).iloc[0]) + " %"
+    validator_change = str(
+        round(df_staking_overview.validator_change*100, 1).iloc[0]) + " %"
 
-    sql_query = """
-    SELECT * FROM dn_depositors_signup_weekly
-    """
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Total Depositors", str(int(
+        df_staking_overview.total_depositors/1000)) + "K+", depositor_change, help="MoM change")
+    col2.metric("Total Validators", str(
+        int(df_staking_overview.num_validators/1000)) + "K+", validator_change, help="MoM change")
+    col3.metric("Total Eth Deposited", str(round(
+        df_staking_overview.eth_deposited/1000000, 1).iloc[0]) + "M+", validator_change, help="MoM change")
 
-    return run_query(sql_query)
+    col1, col2 = st.columns(2)
 
+    with col1:
 
-@st.experimental_memo(ttl=86400)
-def get_empty_block_stats() -> pd.DataFrame:
+        df_validators = get_weekly_validator_signups()
 
-    sql_query = """
-    SELECT * FROM dn_block_stats_empty_missed
-    """
+        plotly_chart("bar", df_validators, x='first_deposit_week', y='validators_signed_up',
+                     color='validators_signed_up', title="Validator Signups",
+                     layout=dict(yaxis_title="Total Validators", xaxis_title='Week'))
 
-    return run_query(sql_query)
+    with col2:
 
+        df_depositors = get_weekly_depositor_signups()
 
-def set_fig_caption(text):
-    st.markdown("<p style='text-align: center; font-size:12px;'>{}</p>".format(text),
-                unsafe_allow_html=True)
+        plotly_chart("bar", df_depositors, x='week', y='depositor_count',
+                     color='depositor_count', title="Depositor Signups",
+                     layout=dict(yaxis_title="Total Depositors", xaxis_title='Week'))
 
 
-client_color = {
-    'Lighthouse': '#00dbeb',
-    'Lodestar': '#ffa71a',
-    'Nimbus': '#f5009b',
-    'Prysm': '#a323d1',
-    'Teku': '#4e00de'
-}
-
-client_tab, staking_tab, onchain_tab = st.tabs(
-    ["Client", "Staking", "On Chain"])
-with client_tab:
-
-    client_tab1, tab2, tab3, tab4 = st.tabs(
-        ["Client Pairings", "Hosting Diversity", "Trending Clients", "Client Effectiveness"])
-
-    with client_tab1:
-
-        df = get_client_info()
-
-        st.metric("Consensus Nodes Discovered", df.total_nodes.sum(),
-                  help="crawler running since 26-Oct-22")
-
-        consensus_clients_fig = px.pie(
-            df, values='total_nodes', names='consensus_client', title='Consensus Client Distribution')
-        st.plotly_chart(consensus_clients_fig, use_container_width=True)
-
-        last_updated = df.last_updated.min()
-        fig_caption = "Data Source : <a href='https://www.twigblock.com/projects/eth-merge-challenge/t/emg-ca-data-collect'>CL crawler</a> ; Last Updated : {} ; Update Frequency: Daily</h1>".format(
-            last_updated.date())
-        set_fig_caption(fig_caption)
-
-        client_pairing_figs = px.treemap(df[(~df.execution_client.isna()) & (df.execution_client != '')], path=[
-                                         'execution_client', 'consensus_client'], values='total_nodes', title='EL-CL Client Pairings')
-        st.plotly_chart(client_pairing_figs, use_container_width=True)
-
-        st.markdown("<p style='text-align: center; font-size:12px;'> IP matches for {} nodes</p>".format(
-            df[(~df.execution_client.isna()) & (df.execution_client != '')].total_nodes.sum()), unsafe_allow_html=True)
-
-        st.markdown("<p style='text-align: center; font-size:12px;'> \
-            Data Source : <a href='https://www.twigblock.com/projects/eth-merge-challenge/t/emg-ca-data-collect'>EL & CL crawler</a> ; Last Updated : {} ; Update Frequency: Daily</p>".format(last_updated.date()), unsafe_allow_html=True)
-
-    with tab2:
-
-        df = get_cl_hosting_diversity_data()
-
-        st.metric("Unique ASNs Found", len(df.asn.unique()),
-                  help="includes ISPs, broadbands etc")
-
-        cl_hosting_fig = px.pie(
-            df, values='total_nodes', names='hosting_provider_name', title='Consensus Hosting Diversity')
-        cl_hosting_fig.update_traces(textposition='inside')
-        cl_hosting_fig.update_layout(
-            uniformtext_minsize=12, uniformtext_mode='hide')
+def render_entity_distribution():
 
-        st.plotly_chart(cl_hosting_fig, use_container_width=True)
-
-        fig_caption = "Data Source : <a href='https://www.twigblock.com/projects/eth-merge-challenge/t/emg-ca-data-collect'>CL crawler</a> ; Last Updated : {} ; Update Frequency: Daily</h1>".format(
-            last_updated.date())
-        set_fig_caption(fig_caption)
+    df_data = get_depositor_staking()
 
-        cl_host_pairings = px.treemap(df[df.hosting_provider_name != 'Others'], path=[
-                                      'hosting_provider_name', 'consensus_client'], values='total_nodes', title='Consensus Client - Hosting Provider : Affinity')
-        st.plotly_chart(cl_host_pairings, use_container_width=True)
+    plotly_chart("pie", df_data, values='total_eth_deposited',
+                 names='depositor_label', title='Depositor Staking Distribution',
+                 traces=dict(textposition='inside'),
+                 layout=dict(uniformtext_minsize=12, uniformtext_mode='hide'))
 
-        fig_caption = "Data Source : <a href='https://www.twigblock.com/projects/eth-merge-challenge/t/emg-ca-data-collect'>CL crawler</a> ; Last Updated : {} ; Update Frequency: Daily</h1>".format(
-            last_updated.date())
-        set_fig_caption(fig_caption)
+    fig_col1, fig_col2 = st.columns(2)
 
-    with tab3:
+    with fig_col1:
+        st.text("Trending by ETH deposited(Last 30 Days)")
+        dataframe("Trending by ETH deposited", get_trending_depositors()
+                     .style.set_properties(**{'color': 'green'}, subset=['Total ETH Deposited (Last 30 Days)'])
+                     .format({'Total ETH Deposited': "{:,}", 'Total ETH Deposited (Last 30 Days)': "{:,}"}))
 
-        df = get_first_proposal_clients()
-        trending_fig = px.line(df, x='first_proposal_month', y='total_validators', color='predicted_client',
-                               markers=True, color_discrete_map=client_color, title="Client Breakdown (by validator's first proposal)")
-        trending_fig.update_layout(xaxis=dict(
-            showgrid=False), yaxis=dict(showgrid=False))
-        trending_fig.update_layout(
-            xaxis_title="Month", yaxis_title="New Validators", legend_title="Client")
-        st.plotly_chart(trending_fig, use_container_width=True)
+    with fig_col2:
+        st.text("Trending by Growth(Change in Last 30 Days)")
+        dataframe("Trending by Growth", get_growing_depositors()
+                     .style.set_properties(**{'color': 'green'}, subset=['Change %'])
+                     .format({'Total ETH Deposited': "{:,}", 'Total ETH Deposited (Last 30 Days)': "{:,}"})
+                     .format({'Change %': "{:.2%}"}))
 
-        last_updated = df.last_updated.min()
-        fig_caption = "Data Source : <a href='https://www.twigblock.com/projects/eth-merge-challenge/t/emg-sa-data-collect'>Client prediction by Blockprint</a> ; Last Updated : {} ; Update Frequency: Monthly</h1>".format(
-            last_updated.date())
-        set_fig_caption(fig_caption)
 
-        df_2 = get_proposals_by_client()
-        fig = px.area(df_2, x="proposal_month", y="total_proposals", color="predicted_client",
-                      color_discrete_map=client_color, pattern_shape="predicted_client", pattern_shape_sequence=[".", "x", "+", "-", '|'],
-                      title="Client Breakdown (by block proposals)")
-        fig.update_layout(xaxis=dict(showgrid=False),
-                          yaxis=dict(showgrid=False))
-        fig.update_layout(xaxis_title="Month",
-                          yaxis_title="Total Proposals", legend_title="Client")
-        st.plotly_chart(fig, use_container_width=True)
+def render_entity_performance():
 
-        fig_caption = "Data Source : <a href='https://www.twigblock.com/projects/eth-merge-challenge/t/emg-sa-data-collect'>Client prediction by Blockprint</a> ; Last Updated : {} ; Update Frequency: Monthly</h1>".format(
-            last_updated.date())
-        set_fig_caption(fig_caption)
+    col1, col2, col3 = st.columns(3)
+    with col2:
+        df_depositor_performance_apr = get_depositor_performance_table()
+        st.text("Depositor Performance (Last 31 days)")
+        paginated_table("Depositor Performance", df_depositor_performance_apr, lambda df: df.style.text_gradient(
+            subset='Average APR', cmap="Greens", vmin=-5, vmax=5).format({'Average APR': "{:.2%}"}), width=500)
 
-    with tab4:
-        col1, col2, col3 = st.columns(3)
-        with col2:
-            df_client_performance_apr = get_client_performance_apr()
-            df_client_performance_apr = df_client_performance_apr.set_index(
-                'client')
-            st.text("Client Performance (Last 31 days)")
-            df_client_performance_apr.rename(columns={
-                'num_validators': 'Total Validators',
-                'median_apr': 'Median APR',
-            }, inplace=True)
-            st.dataframe(df_client_performance_apr.style.text_gradient(
-                subset='Median APR', cmap="Greens", vmin=-5, vmax=5).format({'Median APR': "{:.2%}"}))
-
-        st.text("Client Performance (Last 31 days) Distribution")
-        df_grouped_data = get_client_performance_apr_quartiles()
-        df_grouped_data['APR'] = df_grouped_data['APR'] * 100
-        fig = px.box(df_grouped_data, x="Client", y="APR",
-                     color="Client", color_discrete_map=client_color)
-        fig.update_layout(xaxis=dict(showgrid=False),
-                          yaxis=dict(showgrid=False))
-        fig.update_layout(yaxis_title="APR %")
-        st.plotly_chart(fig, use_container_width=True)
-
-
-with staking_tab:
-
-    tab1, tab2, tab3, tab4 = st.tabs(
-        ["Overview", "Entity Distribution", "Entity Performance", "Entity Diversity"])
-
-    with tab1:
-
-        df_staking_overview = get_staking_overview()
-
-        depositor_change = str(
-            round(df_staking_overview.depositor_change*100, 1).iloc[0]) + " %"
-        validator_change = str(
-            round(df_staking_overview.validator_change*100, 1).iloc[0]) + " %"
-
-        col1, col2, col3 = st.columns(3)
-        col1.metric("Total Depositors", str(int(
-            df_staking_overview.total_depositors/1000)) + "K+", depositor_change, help="MoM change")
-        col2.metric("Total Validators", str(
-            int(df_staking_overview.num_validators/1000)) + "K+", validator_change, help="MoM change")
-        col3.metric("Total Eth Deposited", str(round(
-            df_staking_overview.eth_deposited/1000000, 1).iloc[0]) + "M+", validator_change, help="MoM change")
-
-        col1, col2 = st.columns(2)
-
-        with col1:
-
-            df_validators = get_weekly_validator_signups()
-
-            fig = px.bar(df_validators, x='first_deposit_week', y='validators_signed_up',
-                         color='validators_signed_up', title="Validator Signups")
-            fig.update_layout(yaxis_title="Total Validators",
-                              xaxis_title='Week')
-            st.plotly_chart(fig, use_container_width=True)
-
-        with col2:
-
-            df_depositors = get_weekly_depositor_signups()
-
-            fig = px.bar(df_depositors, x='week', y='depositor_count',
-                         color='depositor_count', title="Depositor Signups")
-            fig.update_layout(yaxis_title="Total Depositors",
-                              xaxis_title='Week')
-            st.plotly_chart(fig, use_container_width=True)
-
-    with tab2:
-
-        df_data = get_depositor_staking()
-
-        fig = px.pie(df_data, values='total_eth_deposited',
-                     names='depositor_label', title='Depositor Staking Distribution')
-        fig.update_traces(textposition='inside')
-        fig.update_layout(uniformtext_minsize=12, uniformtext_mode='hide')
-        st.plotly_chart(fig, use_container_width=True)
-
-        df_data['total_eth_deposited'] = df_data['total_eth_deposited'].astype(
-            int)
-        df_data['eth_deposited_last_30days'] = df_data['eth_deposited_last_30days'].astype(
-            int)
-
-        df_data = df_data[~df_data.depositor_type.isna()]
-        df_data.set_index('depositor_label', inplace=True)
-
-        df_data['Change %'] = (
-            df_data['eth_deposited_last_30days']) / df_data['total_eth_deposited']
-
-        df_data.rename(columns={
-            'depositor_type': 'Depositor Type',
-            'total_eth_deposited': 'Total ETH Deposited',
-            'eth_deposited_last_30days': 'Total ETH Deposited (Last 30 Days)',
-        }, inplace=True)
+    st.text("Depositor Performance (Last 31 days) Distribution")
+    df_grouped_data = get_depositor_performance_apr_quartiles()
+    plotly_chart("box", df_grouped_data, x="Depositor", y="APR", color="Depositor",
+                 layout=dict(xaxis=dict(showgrid=False), yaxis=dict(showgrid=False), yaxis_title="APR %"))
 
-        fig_col1, fig_col2 = st.columns(2)
 
-        with fig_col1:
-            fig1_cols = ['Depositor Type', 'Total ETH Deposited',
-                         'Total ETH Deposited (Last 30 Days)']
-            st.text("Trending by ETH deposited(Last 30 Days)")
-            st.dataframe(df_data[fig1_cols].sort_values('Total ETH Deposited (Last 30 Days)', ascending=False).head(5)
-                         .style.set_properties(**{'color': 'green'}, subset=['Total ETH Deposited (Last 30 Days)'])
-                         .format({'Total ETH Deposited': "{:,}", 'Total ETH Deposited (Last 30 Days)': "{:,}"}))
+def render_entity_diversity():
 
-        with fig_col2:
-            st.text("Trending by Growth(Change in Last 30 Days)")
-            st.dataframe(df_data.sort_values('Change %', ascending=False).head(5)
-                         .style.set_properties(**{'color': 'green'}, subset=['Change %'])
-                         .format({'Total ETH Deposited': "{:,}", 'Total ETH Deposited (Last 30 Days)': "{:,}"})
-                         .format({'Change %': "{:.2%}"}))
+    st.text("Staking Entity Client Distribution")
+    df_2 = get_staking_client_diversity_table()
 
-    with tab3:
+    subset_cols = ['Lighthouse', 'Prysm', 'Teku', 'Nimbus', 'Lodestar']
 
-        col1, col2, col3 = st.columns(3)
-        with col2:
-            df_depositor_performance_apr = get_depositor_performance_apr()
-            df_depositor_performance_apr = df_depositor_performance_apr.set_index(
-                'depositor_label')
-            st.text("Depositor Performance (Last 31 days)")
-            df_depositor_performance_apr.rename(columns={
-                'num_validators': 'Total Validators',
-                'avg_apr': 'Average APR',
-            }, inplace=True)
-            st.dataframe(df_depositor_performance_apr.style.text_gradient(
-                subset='Average APR', cmap="Greens", vmin=-5, vmax=5).format({'Average APR': "{:.2%}"}), width=500)
+    paginated_table("Staking Entity Client Distribution", df_2,
+                    lambda df: df.style.background_gradient(cmap='RdYlGn', axis=1, subset=subset_cols)
+                    .format({'Diversity Coefficient': "{:.2f}"}), height=1024)
 
-        st.text("Depositor Performance (Last 31 days) Distribution")
-        df_grouped_data = get_depositor_performance_apr_quartiles()
-        df_grouped_data['APR'] = df_grouped_data['APR'] * 100
-        fig = px.box(df_grouped_data, x="Depositor",
-                     y="APR", color="Depositor")
-        fig.update_layout(xaxis=dict(showgrid=False),
-                          yaxis=dict(showgrid=False))
-        fig.update_layout(yaxis_title="APR %")
-        st.plotly_chart(fig, use_container_width=True)
 
-    with tab4:
+def render_block_stats():
 
-        st.text("Staking Entity Client Distribution")
-        df_data = get_staking_client_distribution()
+    df_data = get_empty_block_stats()
 
-        df_2 = df_data.pivot(index="staking_entity", columns="client",
-                             values="tot_validators").reset_index().fillna(0)
-        df_2['Total Validators'] = df_2['Lighthouse'] + \
-            df_2['Lodestar'] + df_2['Nimbus'] + df_2['Prysm'] + df_2['Teku']
+    col1, col2 = st.columns(2)
 
-        df_2.set_index('staking_entity', inplace=True)
+    with col1:
 
-        subset_cols = ['Lighthouse', 'Prysm', 'Teku', 'Nimbus', 'Lodestar']
+        plotly_chart("bar", df_data, x="day", y="empty_blocks",
+                     title="Empty blocks (Last 3 Months)",
+                     layout=dict(yaxis_title="Empty Blocks", xaxis_title='Day',
+                                 xaxis=dict(showgrid=False), yaxis=dict(showgrid=False)))
 
-        for col in subset_cols:
-            df_2[col] = df_2[col].astype(int)
+    with col2:
 
-        df_2['Total Validators'] = df_2['Total Validators'].astype(int)
+        plotly_chart("bar", df_data, x="day", y="missed_slots",
+                     title="Missed Slots (Last 3 Months)",
+                     layout=dict(yaxis_title="Missed Slots", xaxis_title='Day',
+                                 xaxis=dict(showgrid=False), yaxis=dict(showgrid=False)))
 
-        def gini(x):
-            # Mean absolute difference.
-            mad = np.abs(np.subtract.outer(x, x)).mean()
-            # Relative mean absolute difference
-            rmad = mad / np.mean(x)
-            # Gini coefficient is half the relative mean absolute difference.
-            return 0.5 * rmad
 
-        def get_client_diversity_coefficient(x):
-
-            return gini(list(x))
+GAS_FEE_RANGES = {
+    "Day": timedelta(days=1),
+    "Week": timedelta(days=7),
+    "Month": timedelta(days=30),
+    "Year": timedelta(days=365),
+    "All": None,
+}
 
-        df_2['Diversity Coefficient'] = df_2.apply(
-            lambda x: get_client_diversity_coefficient(x[subset_cols]), axis=1)
 
-        cols = ['Diversity Coefficient', 'Lighthouse', 'Prysm',
-                'Teku', 'Nimbus', 'Lodestar', 'Total Validators']
+def render_gas_fee_market():
+
+    store = get_block_store()
+    if not len(store.blocks.slot):
+        st.info("No block data yet.")
+        return
+
+    first, last = (pd.Timestamp(t, unit="s").to_pydatetime() for t in time_range(store))
+    view = st.radio("Range", list(GAS_FEE_RANGES), index=1, horizontal=True, key="gas_fee_range")
+    span = GAS_FEE_RANGES[view]
+    start = max(first, last - span) if span else first
+
+    # Zooming asks the block store for the range again; it answers from the
+    # coarsest rollup that still fills the chart, whatever the range.
+    start, end = st.slider("Zoom (UTC)", min_value=first, max_value=last, value=(start, last),
+                           step=timedelta(hours=1), format="YYYY-MM-DD HH:mm",
+                           key="gas_fee_zoom_{}".format(view))
+    resolution, df_data = fee_series(int(pd.Timestamp(start).timestamp()), int(pd.Timestamp(end).timestamp()))
+
+    df_fees = df_data.melt(id_vars="time", value_vars=["base_fee", "priority_fee"],
+                           var_name="fee", value_name="gwei")
+    df_fees["fee"] = df_fees.fee.map({"base_fee": "Base fee", "priority_fee": "Priority fee"})
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+
+        plotly_chart("line", df_fees, x="time", y="gwei", color="fee",
+                     title="Base and Priority Fee per Gas",
+                     layout=dict(yaxis_title="Gwei", xaxis_title="Time (UTC)", legend_title=None,
+                                 xaxis=dict(showgrid=False), yaxis=dict(showgrid=False)))
+
+    with col2:
+
+        plotly_chart("line", df_data, x="time", y="gas_used",
+                     title="Gas Used per Block",
+                     layout=dict(yaxis_title="Gas Used", xaxis_title="Time (UTC)",
+                                 xaxis=dict(showgrid=False), yaxis=dict(showgrid=False)))
+
+    set_fig_caption("{:,} blocks, averaged per {}".format(int(df_data.blocks.sum()), resolution)
+                    if resolution != "slot" else "{:,} blocks".format(len(df_data)))
+
+
+DASHBOARD_TABS = {
+    "Client": {
+        "Client Pairings": (render_client_pairings, [get_client_info, get_client_pairings]),
+        "Hosting Diversity": (render_hosting_diversity, [get_cl_hosting_diversity_data, get_hosting_provider_affinity]),
+        "Trending Clients": (render_trending_clients, [get_first_proposal_clients, get_proposals_by_client]),
+        "Client Effectiveness": (render_client_effectiveness, [get_client_performance_table, get_client_performance_apr_quartiles]),
+    },
+    "Staking": {
+        "Overview": (render_staking_overview, [get_staking_overview, get_weekly_validator_signups, get_weekly_depositor_signups]),
+        "Entity Distribution": (render_entity_distribution, [get_depositor_staking, get_trending_depositors, get_growing_depositors]),
+        "Entity Performance": (render_entity_performance, [get_depositor_performance_table, get_depositor_performance_apr_quartiles]),
+        "Entity Diversity": (render_entity_diversity, [get_staking_client_diversity_table]),
+    },
+    "On Chain": {
+        "Block Stats": (render_block_stats, [get_empty_block_stats]),
+        "Gas Fee Market": (render_gas_fee_market, [get_block_store]),
+    },
+}
 
-        st.dataframe(df_2[cols].sort_values('Diversity Coefficient').style.background_gradient(cmap='RdYlGn', axis=1, subset=subset_cols)
-                     .format({'Diversity Coefficient': "{:.2f}"}), height=1024)
+if get_setting("DIAGNOSTICS", False) or st.experimental_get_query_params().get("diagnostics") == ["1"]:
+    DASHBOARD_TABS["Diagnostics"] = {
+        "Performance": (render_diagnostics, []),
+    }
 
-with onchain_tab:
 
-    tab1, tab2 = st.tabs(["Block Stats", "Gas Fee Market"])
+def tab_selector(label, options, state_key):
 
-    with tab1:
-        df_data = get_empty_block_stats()
+    # The selection is kept under its own session state key because
+    # Streamlit drops the state of widgets that are not rendered in a run,
+    # which would reset a sub-tab whenever its parent tab is hidden.
+    selected = st.session_state.get(state_key, options[0])
+    index = options.index(selected) if selected in options else 0
+    selected = st.radio(label, options, index=index,
+                        horizontal=True, label_visibility="collapsed")
+    st.session_state[state_key] = selected
+    return selected
 
-        col1, col2 = st.columns(2)
 
-        with col1:
+if get_setting("LAZY_TABS", True):
 
-            fig = px.bar(df_data, x="day", y="empty_blocks",
-                         title="Empty blocks (Last 3 Months)")
+    main_tab = tab_selector("Section", list(DASHBOARD_TABS), "main_tab")
+    sub_tabs = DASHBOARD_TABS[main_tab]
+    sub_tab = tab_selector(main_tab, list(sub_tabs), "{}_tab".format(main_tab))
 
-            fig.update_layout(yaxis_title="Empty Blocks", xaxis_title='Day')
-            fig.update_layout(xaxis=dict(showgrid=False),
-                              yaxis=dict(showgrid=False))
-            st.plotly_chart(fig, use_container_width=True)
+    render_tab, tab_loaders = sub_tabs[sub_tab]
+    if get_setting("PREFETCH", True):
+        prefetch(tab_loaders)
+    render_tab()
 
-        with col2:
+else:
 
-            fig = px.bar(df_data, x="day", y="missed_slots",
-                         title="Missed Slots (Last 3 Months)")
+    if get_setting("PREFETCH", True):
+        prefetch(list(dict.fromkeys(
+            loader for sub_tabs in DASHBOARD_TABS.values() for _, loaders in sub_tabs.values() for loader in loaders)))
 
-            fig.update_layout(yaxis_title="Missed Slots", xaxis_title='Day')
-            fig.update_layout(xaxis=dict(showgrid=False),
-                              yaxis=dict(showgrid=False))
-            st.plotly_chart(fig, use_container_width=True)
+    for main_tab, main_container in zip(DASHBOARD_TABS, st.tabs(list(DASHBOARD_TABS))):
+        with main_container:
+            sub_tabs = DASHBOARD_TABS[main_tab]
+            for (render_tab, _), sub_container in zip(sub_tabs.values(), st.tabs(list(sub_tabs))):
+                with sub_container:
+                    render_tab()
 
-    with tab2:
-        st.text("Coming soon!")
+write_metrics()
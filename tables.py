@@ -0,0 +1,43 @@
+import numpy as np
+import streamlit as st
+
+from config import get_setting
+from instrumentation import dataframe
+
+
+@st.experimental_memo(max_entries=64)
+def sort_index(df, column, ascending=True) -> np.ndarray:
+
+    # Row positions of df ordered by column, or by the index when column is
+    # not one of its columns. Built once per frame and order, then reused
+    # by every page and rerun.
+    values = df[column] if column in df.columns else df.index.to_series()
+    values = values.reset_index(drop=True)
+    return values.sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+
+
+def paginated_table(name, df, style=None, sort_by=None, page_size=None, **kwargs):
+
+    # Renders one page of df with sort and page controls. Only the page is
+    # passed through style, a function from a frame to a Styler, and sent to
+    # the browser, so the cost no longer grows with the size of the table.
+    # sort_by is a (column, ascending) pair; None keeps the order of df.
+    # The controls don't use st.columns, so tables can sit inside columns.
+    page_size = page_size or get_setting("TABLE_PAGE_SIZE", 50)
+    page = 1
+
+    if len(df) > page_size:
+        options = [None] + [(column, ascending)
+                            for column in [df.index.name or "index"] + list(df.columns)
+                            for ascending in (True, False)]
+        sort_by = st.selectbox(
+            "Sort by", options, index=options.index(sort_by), key="{} sort".format(name),
+            format_func=lambda option: "Default order" if option is None else "{} ({})".format(
+                option[0], "ascending" if option[1] else "descending"))
+        pages = -(-len(df) // page_size)
+        page = st.number_input("Page (of {})".format(pages), min_value=1, max_value=pages,
+                               value=1, key="{} page".format(name))
+
+    positions = np.arange(len(df)) if sort_by is None else sort_index(df, *sort_by)
+    window = df.iloc[positions[(page - 1) * page_size:page * page_size]]
+    dataframe(name, style(window) if style else window, **kwargs)
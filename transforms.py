@@ -0,0 +1,82 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+
+def gini_coefficients(values) -> np.ndarray:
+
+    # Row-wise Gini coefficient of a 2-D array, i.e. half the relative mean
+    # absolute difference of each row. With each row sorted ascending,
+    # sum_ij |x_i - x_j| = 2 * sum_i (2i - n - 1) * x_i, which gives
+    # G = sum_i (2i - n - 1) * x_i / (n * sum_i x_i) without the n x n
+    # difference matrix. Rows summing to zero give NaN.
+    x = np.sort(np.asarray(values, dtype=float), axis=1)
+    n = x.shape[1]
+    weights = 2 * np.arange(1, n + 1) - n - 1
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (x @ weights) / (n * x.sum(axis=1))
+
+
+# Label columns with few distinct values across the dashboard tables.
+CATEGORY_COLUMNS = {
+    "asn", "client", "consensus_client", "depositor_label", "depositor_type", "execution_client",
+    "hosting_provider_name", "predicted_client", "staking_entity",
+}
+DATE_COLUMNS = {
+    "day", "first_deposit_week", "first_proposal_month", "last_updated", "proposal_month", "week",
+}
+# Rates, where float32's ~7 significant digits are plenty. Other floats,
+# e.g. ETH balances, stay float64.
+FLOAT32_COLUMNS = {
+    "apr", "apr_25pct", "apr_75pct", "avg_apr", "depositor_change", "max_apr", "median_apr", "min_apr",
+    "validator_change",
+}
+MAX_CATEGORY_RATIO = 0.5
+
+
+def compact_dtypes(df):
+
+    # Schema-aware post-load stage: parses the known date columns held as
+    # text or date objects, turns the known label columns into categoricals
+    # when they repeat enough to pay off, converts DECIMAL results (object
+    # columns of Decimal) to floats, downcasts integers to 32 bits when
+    # they fit and the known rate columns to float32. Counts are not downcast further so that column arithmetic
+    # in the tabs cannot overflow.
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if column in DATE_COLUMNS and (values.dtype == object or pd.api.types.is_string_dtype(values)):
+            # Only text is parsed: pandas would read integer keys, e.g.
+            # YEARWEEK, as nanoseconds since 1970.
+            df[column] = pd.to_datetime(values)
+        elif column in CATEGORY_COLUMNS:
+            if values.dtype == object and values.nunique() <= MAX_CATEGORY_RATIO * len(values):
+                df[column] = values.astype("category")
+        elif values.dtype == object:
+            if len(values.dropna()) and values.dropna().map(type).eq(Decimal).all():
+                df[column] = values.astype(np.float32 if column in FLOAT32_COLUMNS else float)
+        elif pd.api.types.is_integer_dtype(values):
+            if len(values) and values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max:
+                df[column] = values.astype(np.int32)
+        elif pd.api.types.is_float_dtype(values) and column in FLOAT32_COLUMNS:
+            df[column] = values.astype(np.float32)
+
+    return df
+
+
+def concat_compact(frames) -> pd.DataFrame:
+
+    # Concatenates frames returned by compact_dtypes, e.g. the chunks of a
+    # streamed query. A label column that is categorical in any frame becomes
+    # one categorical over the union of the categories, where pd.concat would
+    # fall back to object.
+    frames = list(frames)
+    for column in frames[0].columns:
+        if any(isinstance(df[column].dtype, pd.CategoricalDtype) for df in frames):
+            categories = sorted(set().union(*(df[column].dropna().unique() for df in frames)))
+            dtype = pd.CategoricalDtype(categories)
+            frames = [df.astype({column: dtype}) for df in frames]
+
+    return pd.concat(frames, ignore_index=True)